@@ -0,0 +1,87 @@
+"""
+Measures the per-query overhead of `Database`.
+
+The same lookups are run against a scratch database twice: once opening a new
+aiosqlite connection per query (how `Database` used to work), and once through
+`Database` with its persistent connection.
+
+Usage:
+    python benchmarks/db_overhead.py [queries]
+"""
+
+import os
+import sys
+import time
+import asyncio
+import tempfile
+import datetime
+import aiosqlite
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from utils.database import Database
+from utils.models import Project, Task, User
+
+
+async def seed(db: Database) -> None:
+    await db.create_tables()
+    for i in range(20):
+        await db.create_project(
+            Project(f"Project {i}", i, i, f"https://github.com/crux/p{i}", "")
+        )
+    for i in range(100):
+        await db.create_user(User(id=i, name=f"user{i}"))
+    for i in range(2000):
+        await db.create_task(
+            Task(
+                f"Task {i}",
+                "",
+                i % 20 + 1,
+                datetime.datetime.now(),
+                "Not Started",
+                "App Dev",
+                i % 100,
+            )
+        )
+
+
+async def per_query_connection(db_path: str, queries: int) -> float:
+    async def fetchall(query, *args):
+        async with aiosqlite.connect(db_path) as conn:
+            data = await conn.execute(query, args)
+            return await data.fetchall()
+
+    start = time.perf_counter()
+    for i in range(queries):
+        await fetchall("SELECT * FROM users WHERE id = ?;", i % 100)
+        await fetchall("SELECT * FROM projects;")
+    return time.perf_counter() - start
+
+
+async def persistent_connection(db: Database, queries: int) -> float:
+    start = time.perf_counter()
+    for i in range(queries):
+        await db.fetch_user(i % 100)
+        await db.fetchall("SELECT * FROM projects;")
+    return time.perf_counter() - start
+
+
+async def main(queries: int) -> None:
+    with tempfile.TemporaryDirectory() as tmp:
+        db = Database()
+        db.db_path = os.path.join(tmp, "bench.db")
+        await seed(db)
+
+        before = await per_query_connection(db.db_path, queries)
+        after = await persistent_connection(db, queries)
+        await db.close()
+
+    n = queries * 2
+    print(f"{n} queries")
+    print(f"connection per query: {before / n * 1e6:8.1f} us/query")
+    print(f"persistent connection: {after / n * 1e6:8.1f} us/query")
+    print(f"speedup: {before / after:.1f}x")
+
+
+if __name__ == "__main__":
+    asyncio.run(main(int(sys.argv[1]) if len(sys.argv) > 1 else 1000))
@@ -0,0 +1,228 @@
+"""
+Replays GitHub webhook events at `/webhook` and reports throughput and latency.
+
+Events come from logs written by the bot (`data/webhooks/webhooks.jsonl.gz*`), or are
+generated with `--synthetic`. By default the bot's webserver is started here with Discord
+stubbed out: projects are created for every repository in the events, and sending a
+message just sleeps for `--send-latency` milliseconds. Pass `--url` to replay against a
+bot that is already running instead, then only the acknowledgement latency is reported.
+
+Usage:
+    python benchmarks/replay_webhooks.py data/webhooks/webhooks.jsonl.gz --rate 200
+    python benchmarks/replay_webhooks.py --synthetic 2000 --rate 0
+"""
+
+import os
+import sys
+import time
+import uuid
+import asyncio
+import argparse
+import tempfile
+from types import SimpleNamespace
+from typing import Any, Dict, List
+
+import aiohttp
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from utils.database import Database
+from utils.metrics import Latencies
+from utils.models import Project
+from utils.webhooks import read_event_log
+
+
+def synthetic_events(count: int, repositories: int = 5) -> List[Dict[str, Any]]:
+    events = []
+    for i in range(count):
+        name = f"crux/repo{i % repositories}"
+        repository = {"full_name": name, "html_url": f"https://github.com/{name}"}
+        if i % 2:
+            payload = {
+                "repository": repository,
+                "action": "labeled",
+                "issue": {
+                    "title": f"Issue {i}",
+                    "html_url": f"https://github.com/{name}/issues/{i}",
+                },
+                "sender": {"login": "triage-bot"},
+            }
+            events.append({"event": "issues", "payload": payload})
+        else:
+            payload = {
+                "repository": repository,
+                "ref": "refs/heads/main",
+                "commits": [{"message": f"Commit {i}", "author": {"name": "dev"}}],
+            }
+            events.append({"event": "push", "payload": payload})
+    return events
+
+
+class StubChannel:
+    def __init__(self, latency: float) -> None:
+        self.latency = latency
+        self.messages = 0
+
+    async def send(self, *args, **kwargs) -> None:
+        await asyncio.sleep(self.latency)
+        self.messages += 1
+
+
+async def start_stub_bot(args, events, tmp: str):
+    """
+    Start the bot's webserver with Discord stubbed out.
+    """
+
+    from cogs.webserver import Webserver
+
+    db = Database()
+    db.db_path = os.path.join(tmp, "replay.db")
+    await db.create_tables()
+    for url in {event["payload"]["repository"]["html_url"] for event in events}:
+        await db.create_project(Project(url, 0, 0, url, ""))
+
+    async def wait_until_ready() -> None:
+        pass
+
+    channel = StubChannel(args.send_latency / 1000)
+    bot = SimpleNamespace(
+        db=db,
+        config=SimpleNamespace(
+            webhook_workers=args.workers,
+            webhook_queue_size=args.queue_size,
+            webhook_coalesce_window=args.window,
+            webhook_max_batch=args.max_batch,
+            webhook_log_dir=None,
+        ),
+        get_channel=lambda channel_id: channel,
+        wait_until_ready=wait_until_ready,
+    )
+    webserver = Webserver(bot)
+    await webserver.webserver()
+    return db, webserver, channel
+
+
+async def replay(args, events) -> Latencies:
+    """
+    Post the events at `args.rate` per second (as fast as possible if 0), at most `args.concurrency` at once.
+    """
+
+    acks = Latencies(window=len(events))
+    statuses: Dict[int, int] = {}
+    semaphore = asyncio.Semaphore(args.concurrency)
+
+    async with aiohttp.ClientSession() as session:
+
+        async def post(event: Dict[str, Any]) -> None:
+            # Replayed events get new delivery ids, unless testing deduplication
+            delivery_id = event.get("delivery") if args.keep_delivery_ids else None
+            headers = {
+                "X-GitHub-Event": event["event"],
+                "X-GitHub-Delivery": delivery_id or str(uuid.uuid4()),
+            }
+            async with semaphore:
+                start = time.perf_counter()
+                async with session.post(
+                    args.url, json=event["payload"], headers=headers
+                ) as response:
+                    await response.read()
+                acks.record(time.perf_counter() - start)
+                statuses[response.status] = statuses.get(response.status, 0) + 1
+
+        start = time.perf_counter()
+        tasks = []
+        for i, event in enumerate(events):
+            if args.rate > 0:
+                delay = start + i / args.rate - time.perf_counter()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+            tasks.append(asyncio.create_task(post(event)))
+        await asyncio.gather(*tasks)
+
+    print(f"responses: {dict(sorted(statuses.items()))}")
+    return acks
+
+
+def report(name: str, latencies: Latencies, elapsed: float) -> None:
+    print(
+        f"{name}: {latencies.count / elapsed:8.1f} events/s, "
+        f"p50 {latencies.quantile(0.5) * 1000:7.1f} ms, "
+        f"p95 {latencies.quantile(0.95) * 1000:7.1f} ms, "
+        f"p99 {latencies.quantile(0.99) * 1000:7.1f} ms"
+    )
+
+
+async def main(args) -> None:
+    events: List[Dict[str, Any]] = []
+    for path in args.logs:
+        events.extend(read_event_log(path))
+    if args.synthetic:
+        events.extend(synthetic_events(args.synthetic))
+    if not events:
+        sys.exit("No events to replay, pass a log or --synthetic")
+
+    print(f"{len(events)} events")
+
+    if args.url is not None:
+        start = time.perf_counter()
+        acks = await replay(args, events)
+        report("acknowledged", acks, time.perf_counter() - start)
+        return
+
+    args.url = "http://localhost:8080/webhook"
+    with tempfile.TemporaryDirectory() as tmp:
+        db, webserver, channel = await start_stub_bot(args, events, tmp)
+        pipeline = webserver.webhooks
+
+        start = time.perf_counter()
+        acks = await replay(args, events)
+        acked = time.perf_counter() - start
+        while pipeline.pending:
+            await asyncio.sleep(0.01)
+        posted = time.perf_counter() - start
+
+        report("acknowledged", acks, acked)
+        report("posted", pipeline.latencies, posted)
+        print(f"discord messages: {channel.messages}")
+
+        await webserver.cog_unload()
+        await db.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("logs", nargs="*", help="Event logs to replay, in order")
+    parser.add_argument(
+        "--synthetic",
+        type=int,
+        default=0,
+        help="Also replay this many generated events",
+    )
+    parser.add_argument(
+        "--rate",
+        type=float,
+        default=100,
+        help="Events per second, 0 for as fast as possible",
+    )
+    parser.add_argument(
+        "--concurrency", type=int, default=50, help="Maximum requests in flight"
+    )
+    parser.add_argument(
+        "--url",
+        help="Replay against a running bot instead, e.g. http://localhost:8080/webhook",
+    )
+    parser.add_argument(
+        "--keep-delivery-ids",
+        action="store_true",
+        help="Send the recorded delivery ids",
+    )
+    parser.add_argument(
+        "--send-latency", type=float, default=100, help="Stubbed Discord latency in ms"
+    )
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--queue-size", type=int, default=1000)
+    parser.add_argument(
+        "--window", type=float, default=5, help="Coalescing window in seconds"
+    )
+    parser.add_argument("--max-batch", type=int, default=25)
+    asyncio.run(main(parser.parse_args()))
@@ -11,7 +11,9 @@ import platform
 from colorama import Back, Style, Fore
 
 from utils import Database
+from utils.autocomplete import AutocompleteService
 from utils.github import GithubAPIError, GithubRequestsManager
+from utils.mail import Mailer
 
 try:
     import dotenv
@@ -30,7 +32,30 @@ class Config:
         self.email_password = os.environ["EMAIL_PASSWORD"]
 
         self.smtp_host = os.environ.get("SMTP_HOST", "smtp.gmail.com")
-        self.smtp_port = os.environ.get("SMTP_PORT", 587)
+        self.smtp_port = int(os.environ.get("SMTP_PORT", 587))
+        self.smtp_pool_size = int(os.environ.get("SMTP_POOL_SIZE", 2))
+        # A due reminder is held back this many seconds to send the member's others with it
+        self.reminder_digest_window = int(
+            os.environ.get("REMINDER_DIGEST_WINDOW", 60 * 60)
+        )
+        # Update task sheets right after tasks change, instead of only at midnight
+        self.live_task_sheets = (
+            os.environ.get("LIVE_TASK_SHEETS", "false").lower() == "true"
+        )
+
+        self.webhook_workers = int(os.environ.get("WEBHOOK_WORKERS", 4))
+        self.webhook_queue_size = int(os.environ.get("WEBHOOK_QUEUE_SIZE", 1000))
+        # Events a repository sends within this many seconds are posted as one message
+        self.webhook_coalesce_window = float(
+            os.environ.get("WEBHOOK_COALESCE_WINDOW", 5)
+        )
+        self.webhook_max_batch = int(os.environ.get("WEBHOOK_MAX_BATCH", 25))
+        # Accepted webhook events are logged here for replaying, empty to disable
+        self.webhook_log_dir = os.environ.get("WEBHOOK_LOG_DIR", "./data/webhooks")
+        self.webhook_log_max_bytes = (
+            int(os.environ.get("WEBHOOK_LOG_MAX_MB", 16)) * 1024 * 1024
+        )
+        self.webhook_log_backups = int(os.environ.get("WEBHOOK_LOG_BACKUPS", 5))
 
         self.openai_api_key = os.environ["OPENAI_API_KEY"]
 
@@ -48,6 +73,16 @@ class CruxTaskBot(commands.Bot):
     def __init__(self):
         self.config = Config()
         self.db = Database()
+        self.autocomplete = AutocompleteService(self.db)
+        self.mailer = Mailer(
+            self.db,
+            hostname=self.config.smtp_host,
+            port=self.config.smtp_port,
+            sender=self.config.email_id,
+            username=self.config.email_id,
+            password=self.config.email_password,
+            pool_size=self.config.smtp_pool_size,
+        )
 
         intents = Intents.default()
         intents.members = True
@@ -82,6 +117,8 @@ class CruxTaskBot(commands.Bot):
 
         await self.load_extension("jishaku")
 
+        self.mailer.start()
+
     async def on_ready(self):
         await self.db.create_tables()
         self.gh = GithubRequestsManager(
@@ -109,6 +146,11 @@ class CruxTaskBot(commands.Bot):
         )
         print(Style.RESET_ALL)
 
+    async def close(self) -> None:
+        await super().close()
+        await self.mailer.close()
+        await self.db.close()
+
     async def run_async(self, func, *args, **kwargs):
         return await self.loop.run_in_executor(None, func, *args, **kwargs)
 
@@ -84,20 +84,7 @@ class GoogleCalendar(commands.Cog):
             List[app_commands.Choice]: The list of choices
         """
 
-        tasks = await self.bot.db.list_user_tasks(interaction.user.id)
-        projects = await self.bot.db.list_all_projects()
-
-        choices = []
-        for task in tasks:
-            if current.lower() in task.title.lower():
-                project = [p for p in projects if p.id == task.project_id][0]
-                formatted_task_title = project.title + " - " + task.title
-                task_value = f"{task.project_id}:{task.id}"
-                choices.append(
-                    app_commands.Choice(name=formatted_task_title, value=task_value)
-                )
-
-        return choices
+        return await self.bot.autocomplete.user_tasks(interaction.user.id, current)
 
     @app_commands.command(
         name="add-to-calendar",
@@ -198,15 +198,7 @@ class Github(commands.Cog):
     async def project_autocomplete(
         self, interaction: discord.Interaction, current: str
     ):
-        projects = await self.bot.db.list_all_projects()
-        return [
-            app_commands.Choice(
-                name=project.title,
-                value=project.title,
-            )
-            for project in projects
-            if current.lower() in project.title.lower()
-        ]
+        return await self.bot.autocomplete.projects(current)
 
     @app_commands.command(
         name="track-project-github",
@@ -226,29 +218,27 @@ class Github(commands.Cog):
         This command sets up tracking the GitHub repository of a project.
         """
 
-        projects = await self.bot.db.list_all_projects()
-        matching_projects = [p for p in projects if p.title == project]
-        if not matching_projects:
+        project_obj = await self.bot.db.fetch_project(project)
+        if project_obj is None:
             return await interaction.response.send_message(
                 f"Project with title {project} not found!"
             )
 
-        project = matching_projects[0]
         await interaction.response.defer()
 
-        if project.webhook_id is not None:
+        if project_obj.webhook_id is not None:
             return await interaction.followup.send(
-                f"Tracking already setup for {project.title} with id={project.webhook_id}!"
+                f"Tracking already setup for {project_obj.title} with id={project_obj.webhook_id}!"
             )
 
-        res = await self.setup_webhook_for_project(project)
+        res = await self.setup_webhook_for_project(project_obj)
         if res[0]:
             await interaction.followup.send(
-                f"Tracking setup for {project.title} with id={res[1]}!"
+                f"Tracking setup for {project_obj.title} with id={res[1]}!"
             )
         else:
             await interaction.followup.send(
-                f"Failed to setup tracking for {project.title}, response={res[1]} {res[2]}!"
+                f"Failed to setup tracking for {project_obj.title}, response={res[1]} {res[2]}!"
             )
 
     async def setup_webhook_for_project(self, project: Project):
@@ -1,14 +1,21 @@
 import enum
 import asyncio
+import hashlib
+import traceback
 import datetime
 import discord
 from discord.ext import commands
 from discord import app_commands
 from utils import is_valid_github_repo_url
-from utils.models import Project, Task
+from utils.models import Project, Task, TaskSheet
 from typing import List, Literal, Optional
 from dateutil import parser as date_parser
-from utils import parse_time_to_seconds
+from utils import parse_time_to_seconds, split_message
+
+# The number of channels task sheets are sent to at once
+TASK_SHEET_CONCURRENCY = 5
+# The number of seconds to wait after a task changes before updating the task sheets
+TASK_SHEET_UPDATE_DELAY = 10
 
 
 class Domains(enum.Enum):
@@ -29,6 +36,10 @@ class Domains(enum.Enum):
 class Projects(commands.Cog):
     def __init__(self, bot: commands.Bot):
         self.bot = bot
+        self.task_sheets: Optional[asyncio.Task] = None
+        self.task_sheets_update: Optional[asyncio.Task] = None
+        # Keeps two updates from sending the same sheet
+        self.task_sheets_lock = asyncio.Lock()
 
     @app_commands.command(
         name="create-project",
@@ -100,20 +111,7 @@ class Projects(commands.Cog):
     async def project_autocomplete(
         self, interaction: discord.Interaction, current: str
     ):
-        projects = await self.bot.db.list_all_projects()
-        if "Senate" in [r.name for r in interaction.user.roles]:
-            return [
-                app_commands.Choice(name=p.title, value=p.title)
-                for p in projects
-                if current.lower() in p.title.lower()
-            ]
-        else:
-            return [
-                app_commands.Choice(name=p.title, value=p.title)
-                for p in projects
-                if p.role in [r.id for r in interaction.user.roles]
-                and current.lower() in p.title.lower()
-            ]
+        return await self.bot.autocomplete.projects(current, interaction.user)
 
     # delete project command
 
@@ -236,25 +234,13 @@ class Projects(commands.Cog):
             reminder=reminder,
         )
         await self.bot.db.create_task(task)
+        self.bot.dispatch("task_change", task.id)
         await interaction.response.send_message(
             f"Task `{title}` under `{project_obj.title}:{domain.value}` created and assigned to {assignee.mention} with deadline: <t:{deadline_datetime.timestamp():.0f}>."
         )
 
     async def task_autocomplete(self, interaction: discord.Interaction, current: str):
-        tasks = await self.bot.db.list_user_tasks(interaction.user.id)
-        projects = await self.bot.db.list_all_projects()
-
-        choices = []
-        for task in tasks:
-            if current.lower() in task.title.lower():
-                project = [p for p in projects if p.id == task.project_id][0]
-                formatted_task_title = project.title + " - " + task.title
-                task_value = f"{task.project_id}:{task.id}"
-                choices.append(
-                    app_commands.Choice(name=formatted_task_title, value=task_value)
-                )
-
-        return choices
+        return await self.bot.autocomplete.user_tasks(interaction.user.id, current)
 
     @app_commands.command(
         name="update-task-status",
@@ -288,6 +274,7 @@ class Projects(commands.Cog):
         task = [t for t in tasks if f"{t.project_id}:{t.id}" == task][0]
 
         await self.bot.db.set_task_status(task.id, status)
+        self.bot.dispatch("task_change", task.id)
         await interaction.response.send_message(
             f"Task `{task.title}` updated with status `{status}`."
         )
@@ -295,16 +282,9 @@ class Projects(commands.Cog):
     async def task_autocomplete_with_project(
         self, interaction: discord.Interaction, current: str
     ):
-        project = await self.bot.db.fetch_project(interaction.namespace.project)
-        if project is None:
-            return []
-
-        tasks = await self.bot.db.list_project_tasks(project.id)
-        choices = []
-        for task in tasks:
-            if current.lower() in task.title.lower():
-                choices.append(app_commands.Choice(name=task.title, value=task.title))
-        return choices
+        return await self.bot.autocomplete.project_tasks(
+            interaction.namespace.project, current
+        )
 
     # Delete task command
     @app_commands.command(name="delete-task", description="Delete a task")
@@ -344,6 +324,7 @@ class Projects(commands.Cog):
         task = [t for t in tasks if t.title == task][0]
 
         await self.bot.db.delete_task(task.id)
+        self.bot.dispatch("task_change", task.id)
         await interaction.response.send_message(
             f"Task `{task.title}` deleted.",
         )
@@ -358,7 +339,6 @@ class Projects(commands.Cog):
         """
 
         tasks = await self.bot.db.list_user_tasks(interaction.user.id)
-        projects = await self.bot.db.list_all_projects()
 
         if not tasks:
             await interaction.response.send_message(
@@ -369,7 +349,7 @@ class Projects(commands.Cog):
         embed = discord.Embed(title="Your Tasks", color=discord.Color.random())
         embed.description = ""
         for task in tasks:
-            project = [p for p in projects if p.id == task.project_id][0]
+            project = await self.bot.db.fetch_project_by_id(task.project_id)
             embed.description += f"- {project.title} - {task.title} - <t:{task.deadline.timestamp():.0f}:R> - {task.status}\n"
 
         await interaction.response.send_message(embed=embed)
@@ -407,9 +387,14 @@ class Projects(commands.Cog):
             )
             return
         final_response = f"# {project}\n" + self.create_task_sheet(tasks)
+        first, *rest = split_message(final_response)
         await interaction.response.send_message(
-            final_response, allowed_mentions=discord.AllowedMentions.none()
+            first, allowed_mentions=discord.AllowedMentions.none()
         )
+        for chunk in rest:
+            await interaction.followup.send(
+                chunk, allowed_mentions=discord.AllowedMentions.none()
+            )
 
     def create_task_sheet(self, tasks: List[Task]) -> str:
         """
@@ -444,38 +429,160 @@ class Projects(commands.Cog):
         final_response = "\n".join(response_message)
         return final_response or "No tasks to display for this project."
 
+    async def send_task_sheet(
+        self, project: Project, tasks: List[Task], sheet: Optional[TaskSheet]
+    ):
+        """
+        Bring a project's pinned task sheet up to date.
+
+        Nothing is sent if the sheet hasn't changed since it was last sent. Otherwise its messages
+        are edited if it still fits in as many, or it is sent again (split into as many messages
+        as needed), pinned, and the outdated messages are deleted.
+        """
+
+        final_response = f"# {project.title}\n" + self.create_task_sheet(tasks)
+        content_hash = hashlib.sha256(final_response.encode()).hexdigest()
+        if (
+            sheet is not None
+            and sheet.channel == project.channel
+            and sheet.content_hash == content_hash
+        ):
+            return
+
+        chunks = split_message(final_response)
+        allowed_mentions = discord.AllowedMentions.none()
+        # Doesn't call the API, a missing channel fails the first request instead
+        channel = self.bot.get_partial_messageable(project.channel)
+
+        # Messages to the same channel share a rate limit bucket, so there is no point sending them at once
+        if (
+            sheet is not None
+            and sheet.channel == project.channel
+            and len(sheet.message_ids) == len(chunks)
+        ):
+            try:
+                for message_id, chunk in zip(sheet.message_ids, chunks):
+                    await channel.get_partial_message(message_id).edit(
+                        content=chunk, allowed_mentions=allowed_mentions
+                    )
+            except discord.NotFound:
+                pass  # Someone deleted the sheet, send it again
+            else:
+                sheet.content_hash = content_hash
+                await self.bot.db.set_task_sheet(sheet)
+                return
+
+        try:
+            messages = [
+                await channel.send(chunk, allowed_mentions=allowed_mentions)
+                for chunk in chunks
+            ]
+        except (discord.NotFound, discord.Forbidden):
+            print(
+                f"Channel of project {project.title} is missing, skipping its task sheet"
+            )
+            return
+
+        await self.bot.db.set_task_sheet(
+            TaskSheet(
+                project_id=project.id,
+                channel=project.channel,
+                message_ids=[message.id for message in messages],
+                content_hash=content_hash,
+            )
+        )
+
+        try:
+            await messages[0].pin()
+        except discord.HTTPException:
+            # The channel may have too many pins, the sheet is still sent
+            traceback.print_exc()
+
+        if sheet is not None:
+            old_channel = self.bot.get_partial_messageable(sheet.channel)
+            for message_id in sheet.message_ids:
+                try:
+                    await old_channel.get_partial_message(message_id).delete()
+                except (discord.NotFound, discord.Forbidden):
+                    pass
+
     async def send_task_sheet_for_every_project(self):
         """
-        This method send's the task sheet for every project to its channel.
+        This method brings the pinned task sheet of every project up to date.
+
+        The tasks of every project are fetched with a single query, and only the sheets that
+        changed are sent or edited, to several channels at once (at most `TASK_SHEET_CONCURRENCY`).
         """
-        projects = await self.bot.db.list_all_projects()
-        for project in projects:
-            tasks = await self.bot.db.list_project_tasks(project.id)
-            channel = self.bot.get_channel(project.channel)
-            final_response = f"# {project.title}\n" + self.create_task_sheet(tasks)
-            await channel.send(
-                final_response, allowed_mentions=discord.AllowedMentions.none()
+
+        async with self.task_sheets_lock:
+            tasks_by_project = await self.bot.db.list_tasks_by_project()
+            sheets = await self.bot.db.list_task_sheets()
+            semaphore = asyncio.Semaphore(TASK_SHEET_CONCURRENCY)
+
+            async def send(project: Project):
+                async with semaphore:
+                    try:
+                        await self.send_task_sheet(
+                            project,
+                            tasks_by_project.get(project.id, []),
+                            sheets.get(project.id),
+                        )
+                    except discord.HTTPException:
+                        traceback.print_exc()  # Keep sending the other projects' sheets
+
+            await asyncio.gather(
+                *(send(project) for project in await self.bot.db.list_all_projects())
             )
 
+    async def update_task_sheets_soon(self):
+        # Let a burst of task changes settle, then update the sheets that changed
+        await asyncio.sleep(TASK_SHEET_UPDATE_DELAY)
+        self.task_sheets_update = None
+        try:
+            await self.send_task_sheet_for_every_project()
+        except Exception:
+            traceback.print_exc()
+
+    @commands.Cog.listener()
+    async def on_task_change(self, task_id: int):
+        if self.bot.config.live_task_sheets and self.task_sheets_update is None:
+            self.task_sheets_update = asyncio.create_task(
+                self.update_task_sheets_soon()
+            )
+
+    async def send_task_sheets_daily(self):
+        """
+        Sleep until midnight, run the send_task_sheet_for_every_project function, and repeat.
+        """
+
+        while True:
+            now = datetime.datetime.now()
+            midnight = now.replace(hour=0, minute=0, second=0, microsecond=0)
+            if now > midnight:
+                midnight += datetime.timedelta(days=1)
+
+            await asyncio.sleep((midnight - now).total_seconds())
+            try:
+                await self.send_task_sheet_for_every_project()
+            except Exception:
+                traceback.print_exc()
+
     @commands.Cog.listener()
     async def on_ready(self):
         """
-        On ready, check how long it is from midnight and sleep until then
-        when its midnight run the send_task_sheet_for_every_project function
-        and then sleep until midnight again.
+        On ready, start updating every project's task sheet at midnight.
         """
 
-        now = datetime.datetime.now()
-        midnight = now.replace(hour=0, minute=0, second=0, microsecond=0)
-        if now > midnight:
-            midnight += datetime.timedelta(days=1)
+        if self.task_sheets is not None:
+            return  # on_ready runs again after reconnects
 
-        time_to_sleep = (midnight - now).total_seconds()
-        await asyncio.sleep(time_to_sleep)
+        self.task_sheets = asyncio.create_task(self.send_task_sheets_daily())
 
-        while True:
-            await self.send_task_sheet_for_every_project()
-            await asyncio.sleep(86400)
+    async def cog_unload(self):
+        if self.task_sheets is not None:
+            self.task_sheets.cancel()
+        if self.task_sheets_update is not None:
+            self.task_sheets_update.cancel()
 
 
 async def setup(bot: commands.Bot) -> None:
@@ -1,82 +1,232 @@
 from discord.ext import commands
 from utils.models import Task, User
 
+import time
+import heapq
+import traceback
 import asyncio
+import string
 import datetime
-from email.message import EmailMessage
-import aiosmtplib
+from typing import Dict, List, Optional, Set, Tuple
+
+SUBJECT = "Crux Task Deadline Reminder"
+
+# Compiled once and filled in for every email
+DIGEST_TEMPLATE = string.Template(
+    "Hi $name,\n\n"
+    "This is a reminder to let you know that you have $tasks_due with the following details:\n\n"
+    "$details\n"
+    "Please make sure to complete your tasks on time. If you have any questions or need assistance, "
+    "feel free to reach out.\n\n"
+    "Best regards,\n"
+    "Crux Task Bot"
+)
+TASK_TEMPLATE = string.Template(
+    "Title: $title\n"
+    "Description: $description\n"
+    "Deadline: $deadline\n"
+    "Time left until the deadline: $time_left\n"
+)
+
+
+def format_time_left(time_left: datetime.timedelta) -> str:
+    message = ""
+    if time_left.days > 0:
+        message += f"{time_left.days} day(s) "
+
+    hours, remainder = divmod(time_left.seconds, 3600)
+    minutes, _ = divmod(remainder, 60)
+    message += f"{hours} hour(s) {minutes} minute(s)"
+    return message
 
 
 class Reminders(commands.Cog):
+    """
+    Emails task reminders exactly when they are due.
+
+    Pending reminders are kept in a min-heap of (fire time, task id), loaded with a single
+    query on startup and updated on every `task_change` event, and the cog sleeps until
+    the earliest one is due (or until a task changes).
+
+    Reminders are never sent early. When a member's first reminder is due it is held back
+    for up to `reminder_digest_window` seconds, and every reminder of theirs that comes due
+    in the meantime is sent along with it, as one email listing all their due tasks.
+    So the number of emails scales with members rather than tasks.
+    The emails are handed to the bot's mailer concurrently.
+    """
+
     def __init__(self, bot: commands.Bot) -> None:
         self.bot = bot
-        self.smtp_client = aiosmtplib.SMTP(
-            hostname=self.bot.config.smtp_host,
-            port=self.bot.config.smtp_port,
-            username=self.bot.config.email_id,
-            password=self.bot.config.email_password,
+
+        self.heap: List[Tuple[float, int]] = []  # (fire time, task id)
+        # The current fire time of every task in the heap
+        self.fire_times: Dict[int, float] = {}
+        # Member id -> (send time, task ids) of the due reminders held back for a digest
+        self.held: Dict[int, Tuple[float, List[int]]] = {}
+        self.wake = asyncio.Event()
+        self.scheduler: Optional[asyncio.Task] = None
+        # Keeps the reminders being sent from being garbage collected
+        self.sending: Set[asyncio.Task] = set()
+
+    async def send_mail(self, to_email: str, subject: str, content: str) -> bool:
+        message = self.bot.mailer.message(to_email, subject, content)
+        return await self.bot.mailer.send(message)
+
+    def construct_email_message(self, user: User, tasks: List[Task]) -> str:
+        now = datetime.datetime.now()
+        details = "\n".join(
+            TASK_TEMPLATE.substitute(
+                title=task.title,
+                description=task.description,
+                deadline=task.deadline,
+                time_left=format_time_left(task.deadline - now),
+            )
+            for task in tasks
+        )
+        return DIGEST_TEMPLATE.substitute(
+            name=user.name,
+            tasks_due="a task" if len(tasks) == 1 else f"{len(tasks)} tasks",
+            details=details,
         )
 
-    async def send_mail(self, to_email: str, subject: str, content: str):
-        message = EmailMessage()
-        message["From"] = self.bot.config.email_id
-        message["To"] = to_email
-        message["Subject"] = subject
-        message.set_content(content)
-
-        await self.smtp_client.send_message(message)
-
-    def construct_email_message(self, task: Task, user: User) -> str:
-        time_until_deadline = task.deadline - datetime.datetime.now()
-        deadline_message = ""
-        if time_until_deadline.days > 0:
-            deadline_message += f"{time_until_deadline.days} day(s) "
-
-        hours, remainder = divmod(time_until_deadline.seconds, 3600)
-        minutes, _ = divmod(remainder, 60)
-        deadline_message += f"{hours} hour(s) {minutes} minute(s)"
-
-        message = (
-            f"Hi {user.name},\n\n"
-            f"This is a reminder to let you know that you have a task with the following details:\n"
-            f"Title: {task.title}\n"
-            f"Description: {task.description}\n"
-            f"Deadline: {task.deadline}\n"
-            f"Time left until the deadline: {deadline_message}\n\n"
-            f"Please make sure to complete the task on time. If you have any questions or need assistance, "
-            f"feel free to reach out.\n\n"
-            f"Best regards,\n"
-            f"Crux Task Bot"
+    def schedule(self, task_id: int, fire_time: float) -> None:
+        # Entries of rescheduled tasks are left in the heap and skipped once they come up
+        self.fire_times[task_id] = fire_time
+        heapq.heappush(self.heap, (fire_time, task_id))
+        self.wake.set()
+
+    def unschedule(self, task_id: int) -> None:
+        self.fire_times.pop(task_id, None)
+
+    async def load_reminders(self) -> None:
+        self.fire_times = {
+            task.id: task.deadline.timestamp() - task.reminder
+            for task, _ in await self.bot.db.list_pending_reminders()
+        }
+        self.heap = [
+            (fire_time, task_id) for task_id, fire_time in self.fire_times.items()
+        ]
+        heapq.heapify(self.heap)
+
+    @commands.Cog.listener()
+    async def on_task_change(self, task_id: int):
+        pending = await self.bot.db.list_pending_reminders([task_id])
+        if pending:
+            task, _ = pending[0]
+            self.schedule(task.id, task.deadline.timestamp() - task.reminder)
+        else:
+            self.unschedule(task_id)
+
+    async def post_email_reminders(self, task_ids: List[int]):
+        # Re-read the tasks, as they may have been completed or deleted since they were scheduled
+        pending = await self.bot.db.list_pending_reminders(task_ids)
+
+        tasks_by_user: Dict[int, Tuple[User, List[Task]]] = {}
+        for task, user in pending:
+            if user is None or user.email is None:  # user didn't set email
+                # Check again later, they may set it before the deadline
+                self.schedule(task.id, time.time() + 60 * 60)
+                continue
+            tasks_by_user.setdefault(user.id, (user, []))[1].append(task)
+
+        if not tasks_by_user:
+            return
+
+        # One email per member, the mailer sends them concurrently over its pool
+        await asyncio.gather(
+            *(
+                self.send_mail(
+                    user.email,
+                    SUBJECT if len(tasks) == 1 else f"{SUBJECT}s ({len(tasks)} tasks)",
+                    self.construct_email_message(
+                        user, sorted(tasks, key=lambda task: task.deadline)
+                    ),
+                )
+                for user, tasks in tasks_by_user.values()
+            )
         )
-        return message
-
-    async def post_email_reminders(self):
-        for project in await self.bot.db.list_all_projects():
-            for task in await self.bot.db.list_project_tasks(project.id):
-                if (
-                    task.reminder is not None
-                    and datetime.timedelta(seconds=0)
-                    < task.deadline - datetime.datetime.now()
-                    < datetime.timedelta(seconds=task.reminder)
-                    and task.status != "Completed"
-                ):
-                    user = await self.bot.db.fetch_user(task.assignee)
-                    if user is None or user.email is None:  # user didn't set email
-                        continue
-
-                    subject = "Crux Task Deadline Reminder"
-                    message = self.construct_email_message(task, user)
-
-                    await self.send_mail(user.email, subject, message)
-                    await self.bot.db.set_task_reminder(task.id, None)
+
+        # Emails that failed now are retried by the mailer, so the reminders are done either way
+        await self.bot.db.clear_task_reminders(
+            [task.id for _, tasks in tasks_by_user.values() for task in tasks]
+        )
+
+    async def hold_reminders(self, task_ids: List[int]) -> None:
+        """
+        Hold due reminders back until their member's digest is sent.
+        """
+
+        window = self.bot.config.reminder_digest_window
+        for task, user in await self.bot.db.list_pending_reminders(task_ids):
+            if user is None or user.email is None:  # user didn't set email
+                # Check again later, they may set it before the deadline
+                self.schedule(task.id, time.time() + 60 * 60)
+                continue
+            self.held.setdefault(user.id, (time.time() + window, []))[1].append(task.id)
+
+    async def _post_email_reminders(self, task_ids: List[int]):
+        try:
+            await self.post_email_reminders(task_ids)
+        except Exception:
+            traceback.print_exc()  # Keep sending the other reminders
+
+    async def run_scheduler(self):
+        await self.load_reminders()
+        while True:
+            while self.heap and self.fire_times.get(self.heap[0][1]) != self.heap[0][0]:
+                heapq.heappop(self.heap)  # Rescheduled or cancelled
+
+            next_times = [send_at for send_at, _ in self.held.values()]
+            if self.heap:
+                next_times.append(self.heap[0][0])
+            timeout = min(next_times) - time.time() if next_times else None
+            if timeout is None or timeout > 0:
+                self.wake.clear()
+                try:
+                    await asyncio.wait_for(self.wake.wait(), timeout)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            now = time.time()
+            task_ids = []
+            while self.heap and self.heap[0][0] <= now:
+                fire_time, task_id = heapq.heappop(self.heap)
+                if self.fire_times.get(task_id) == fire_time:
+                    del self.fire_times[task_id]
+                    task_ids.append(task_id)
+
+            if task_ids:
+                try:
+                    await self.hold_reminders(task_ids)
+                except Exception:
+                    traceback.print_exc()  # Keep the scheduler running
+
+            for user_id, (send_at, task_ids) in list(self.held.items()):
+                if send_at > time.time():
+                    continue
+                del self.held[user_id]
+                # Tasks rescheduled while held are sent at their new time instead
+                task_ids = [
+                    task_id for task_id in task_ids if task_id not in self.fire_times
+                ]
+                if not task_ids:
+                    continue
+
+                sending = asyncio.create_task(self._post_email_reminders(task_ids))
+                self.sending.add(sending)
+                sending.add_done_callback(self.sending.discard)
 
     @commands.Cog.listener()
     async def on_ready(self):
-        await self.smtp_client.connect()
-        await asyncio.sleep(5)  # Wait for database to be ready
-        while True:
-            await self.post_email_reminders()
-            await asyncio.sleep(60 * 60)  # Check every hour
+        if self.scheduler is not None:
+            return  # on_ready runs again after reconnects
+
+        self.scheduler = asyncio.create_task(self.run_scheduler())
+
+    async def cog_unload(self):
+        if self.scheduler is not None:
+            self.scheduler.cancel()
 
 
 async def setup(bot: commands.Bot) -> None:
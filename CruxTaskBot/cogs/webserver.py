@@ -1,15 +1,33 @@
 import discord
-import asyncio
 from aiohttp import web
 from discord.ext import commands
 from discord import app_commands
 from utils import generate_documentation
+from utils.metrics import format_metrics
 from utils.models import User
+from utils.webhooks import EVENT_TYPES, EventLog, RecentDeliveries, WebhookPipeline
 
 
 class Webserver(commands.Cog):
     def __init__(self, bot: commands.Bot) -> None:
         self.bot = bot
+        self.webhooks = WebhookPipeline(
+            bot,
+            workers=bot.config.webhook_workers,
+            max_queue=bot.config.webhook_queue_size,
+            window=bot.config.webhook_coalesce_window,
+            max_batch=bot.config.webhook_max_batch,
+        )
+        self.deliveries = RecentDeliveries(bot.db)
+        self.event_log = (
+            EventLog(
+                bot.config.webhook_log_dir,
+                max_bytes=bot.config.webhook_log_max_bytes,
+                backups=bot.config.webhook_log_backups,
+            )
+            if bot.config.webhook_log_dir
+            else None
+        )
 
     async def webserver(self):
         async def root_handler(request):
@@ -39,6 +57,7 @@ class Webserver(commands.Cog):
                 return web.Response(text="Invalid task", status=401)
 
             await self.bot.db.set_task_status(data["id"], status)
+            self.bot.dispatch("task_change", data["id"])
             return web.Response(text="OK")
 
         async def generate_documentation_handler(request):
@@ -60,96 +79,53 @@ class Webserver(commands.Cog):
 
             return web.json_response({"url": res[-1]["content"]["html_url"]})
 
+        async def metrics_handler(request):
+            return web.Response(
+                text=format_metrics(
+                    {
+                        **self.bot.mailer.metrics_dict(),
+                        **self.webhooks.metrics_dict(),
+                        "crux_webhook_duplicates_total": self.deliveries.duplicates,
+                    }
+                )
+            )
+
         async def webhook_handler(request):
-            data = await request.json()
+            # Only check the event here, it is posted to discord by the pipeline's workers,
+            # so GitHub gets its response long before its delivery timeout
             event_type = request.headers.get("X-GitHub-Event")
-
-            if event_type not in ["issues", "pull_request", "push", "ping"]:
-                return web.Response(text="OK")
-
-            repository = data["repository"]["full_name"]
-            html_url = data["repository"]["html_url"]
-            projects = await self.bot.db.list_all_projects()
-            project = [p for p in projects if p.github_url == html_url]
-            if not project:
+            if event_type not in EVENT_TYPES:
                 return web.Response(text="OK")
 
-            project = project[0]
-            ch = self.bot.get_channel(project.channel)
-            if not ch:
-                ch = await self.bot.fetch_channel(project.channel)
-
-            embed = discord.Embed(
-                title=f"New GitHub Event ({event_type}) for {repository}",
-                color=0x7289DA,
-            )
-
-            embed.add_field(
-                name="Repository",
-                value=f"[{repository}]({html_url})",
-                inline=False,
-            )
-
-            if event_type == "issues":
-                issue_title = data["issue"]["title"]
-                issue_url = data["issue"]["html_url"]
-                embed.add_field(
-                    name="Issue Title",
-                    value=f"[{issue_title}]({issue_url})",
-                    inline=False,
-                )
-                action = data["action"]
-                user = data["sender"]["login"]
-                embed.add_field(
-                    name="Action", value=f"{action} by {user}", inline=False
-                )
-
-            if event_type == "pull_request":
-                pr_title = data["pull_request"]["title"]
-                pr_url = data["pull_request"]["html_url"]
-                embed.add_field(
-                    name="Pull Request Title",
-                    value=f"[{pr_title}]({pr_url})",
-                    inline=False,
-                )
-                action = data["action"]
-                user = data["sender"]["login"]
-                embed.add_field(
-                    name="Action", value=f"{action} by {user}", inline=False
-                )
-
-            if event_type == "push":
-                commits = data["commits"]
-                commit_messages = "\n".join(
-                    [
-                        f"`{commit['message']}` by `{commit['author']['name']}`"
-                        for commit in commits
-                    ]
-                )
-                if commits:
-                    ref = data.get("ref")
-                    if ref:
-                        if ref.startswith("refs/heads/"):
-                            branch_name = ref[len("refs/heads/") :]
-                            embed.add_field(
-                                name="Branch", value=f"`{branch_name}`", inline=False
-                            )
-
-                    embed.add_field(name="Commits", value=commit_messages, inline=False)
-                else:
-                    ref = data.get("ref")
-                    if ref:
-                        if ref.startswith("refs/heads/"):
-                            branch_name = ref[len("refs/heads/") :]
-                            embed.add_field(
-                                name="Branch Created/Updated",
-                                value=f"The branch `{branch_name}` was created or updated.",
-                                inline=False,
-                            )
-
-            await ch.send(embed=embed)
-
-            return web.Response(text="OK")
+            # Drop redeliveries before reading the payload
+            delivery_id = request.headers.get("X-GitHub-Delivery")
+            if delivery_id is not None and not await self.deliveries.add(delivery_id):
+                return web.Response(text="Duplicate delivery")
+
+            # Unless the event is queued, forget its id so a redelivery is accepted,
+            # including when this handler fails
+            accepted = False
+            try:
+                try:
+                    data = await request.json()
+                    if not isinstance(data["repository"]["html_url"], str):
+                        raise TypeError("html_url must be a string")
+                except (ValueError, KeyError, TypeError):
+                    return web.Response(text="Invalid payload", status=400)
+
+                accepted = self.webhooks.submit(event_type, data)
+                if not accepted:
+                    # GitHub doesn't retry failed deliveries on its own, but they can be redelivered
+                    return web.Response(
+                        text="Too many events, try again later", status=503
+                    )
+
+                if self.event_log is not None:
+                    self.event_log.append(event_type, delivery_id, data)
+                return web.Response(text="Accepted", status=202)
+            finally:
+                if not accepted and delivery_id is not None:
+                    await self.deliveries.discard(delivery_id)
 
         app = web.Application()
         app.router.add_get("/", root_handler)
@@ -158,14 +134,22 @@ class Webserver(commands.Cog):
         app.router.add_post("/generate-documentation", generate_documentation_handler)
         app.router.add_post("/push-to-github", push_to_github_handler)
         app.router.add_post("/webhook", webhook_handler)
+        app.router.add_get("/metrics", metrics_handler)
         runner = web.AppRunner(app)
         await runner.setup()
         self.site = web.TCPSite(runner, "localhost", 8080)
         await self.bot.wait_until_ready()
+        await self.deliveries.load()
+        self.webhooks.start()
+        if self.event_log is not None:
+            self.event_log.start()
         await self.site.start()
 
-    def __unload(self):
-        asyncio.ensure_future(self.site.stop())
+    async def cog_unload(self):
+        await self.site.stop()
+        await self.webhooks.close()
+        if self.event_log is not None:
+            await self.event_log.close()
 
     @app_commands.command(
         name="authenticate-extension",
@@ -3,6 +3,7 @@ from .database import Database
 import re
 import openai
 import aiohttp
+from typing import List
 
 
 def parse_time_to_seconds(time_str):
@@ -68,6 +69,42 @@ def is_valid_github_repo_url(url):
     return match is not None
 
 
+def split_message(content: str, limit: int = 2000) -> List[str]:
+    """
+    Splits a message into chunks short enough to send on Discord, breaking at line ends where possible.
+
+    Args:
+        content (str): The message to split.
+        limit (int): The maximum length of a chunk, Discord allows 2000 characters per message.
+
+    Returns:
+        List[str]: The chunks, in order.
+    """
+
+    chunks = []
+    current = None
+    for line in content.split("\n"):
+        # Lines longer than a whole chunk are cut wherever they reach the limit
+        while len(line) > limit:
+            if current is not None:
+                chunks.append(current)
+                current = None
+            chunks.append(line[:limit])
+            line = line[limit:]
+
+        if current is None:
+            current = line
+        elif len(current) + 1 + len(line) <= limit:
+            current += "\n" + line
+        else:
+            chunks.append(current)
+            current = line
+
+    if current is not None:
+        chunks.append(current)
+    return chunks
+
+
 async def extract_github_file_content(
     session: aiohttp.ClientSession, github_file_url: str
 ):
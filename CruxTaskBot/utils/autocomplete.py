@@ -0,0 +1,230 @@
+import re
+import bisect
+import discord
+from discord import app_commands
+from typing import Dict, Generic, Iterable, List, Optional, Set, Tuple, TypeVar
+from .database import Database
+from .models import Project
+
+T = TypeVar("T")
+
+# Discord shows at most 25 autocomplete choices
+MAX_CHOICES = 25
+
+# Separators followed by the start of a word
+WORD_BREAK = re.compile(r"[\s\-_/]+(?=[^\s\-_/])")
+
+
+class TextIndex(Generic[T]):
+    """
+    A prefix/substring index of labels, for ranking autocomplete choices.
+
+    Labels are kept sorted, so the labels starting with the input are found with a binary
+    search, followed by the labels with a later word starting with the input and finally
+    the labels containing it anywhere. Searching stops as soon as enough labels are found.
+
+    Args:
+        entries (Iterable): The (label, value) of every entry.
+    """
+
+    def __init__(self, entries: Iterable[Tuple[str, T]]) -> None:
+        self._entries = sorted(
+            ((label.lower(), label, value) for label, value in entries),
+            key=lambda entry: entry[0],
+        )
+        self._keys = [entry[0] for entry in self._entries]
+
+        # Every word after the first, with the index of its entry
+        words = [
+            (key[match.end() :], i)
+            for i, key in enumerate(self._keys)
+            for match in WORD_BREAK.finditer(key)
+        ]
+        words.sort()
+        self._words = [word for word, _ in words]
+        self._word_entries = [i for _, i in words]
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def search(self, text: str, limit: int = MAX_CHOICES) -> List[Tuple[str, T]]:
+        """
+        Get the best matching entries, best first.
+
+        Returns:
+            List: The (label, value) of up to `limit` entries.
+        """
+
+        text = text.lower().strip()
+        if not text:
+            return [(label, value) for _, label, value in self._entries[:limit]]
+
+        found: List[int] = []
+        seen: Set[int] = set()
+
+        def add(i: int) -> bool:
+            if i not in seen:
+                seen.add(i)
+                found.append(i)
+            return len(found) >= limit
+
+        # Labels starting with the text
+        for i in range(bisect.bisect_left(self._keys, text), len(self._keys)):
+            if not self._keys[i].startswith(text) or add(i):
+                break
+
+        # Labels with a later word starting with the text
+        if len(found) < limit:
+            for j in range(bisect.bisect_left(self._words, text), len(self._words)):
+                if not self._words[j].startswith(text) or add(self._word_entries[j]):
+                    break
+
+        # Labels containing the text anywhere
+        if len(found) < limit:
+            for i, key in enumerate(self._keys):
+                if text in key and add(i):
+                    break
+
+        return [(self._entries[i][1], self._entries[i][2]) for i in found[:limit]]
+
+
+def _choices(entries: List[Tuple[str, str]]) -> List[app_commands.Choice[str]]:
+    # Discord rejects choice names longer than 100 characters
+    return [
+        app_commands.Choice(name=label[:100], value=value) for label, value in entries
+    ]
+
+
+class AutocompleteService:
+    """
+    Answers the autocomplete requests of every cog from in-memory indexes.
+
+    Indexes are built on first use, for all projects, for the projects each set of
+    roles can access, for each user's tasks and for each project's tasks.
+    They are rebuilt after the projects or tasks in the database change.
+
+    Args:
+        db (Database): The bot's database.
+    """
+
+    def __init__(self, db: Database) -> None:
+        self.db = db
+
+        self._projects_version = -1
+        self._all_projects: Optional[TextIndex[str]] = None
+        self._projects_by_role: Dict[int, List[Project]] = {}
+        self._member_projects: Dict[Tuple[int, ...], TextIndex[str]] = {}
+
+        self._tasks_version = (-1, -1)
+        self._user_tasks: Dict[int, TextIndex[str]] = {}
+        self._project_tasks: Dict[int, TextIndex[str]] = {}
+
+    def _versions(self) -> Tuple[int, int]:
+        return self.db.projects_version, self.db.tasks_version
+
+    def _check_versions(self) -> None:
+        """
+        Drop every index built from data that changed since.
+        """
+
+        if self._projects_version != self.db.projects_version:
+            self._projects_version = self.db.projects_version
+            self._all_projects = None
+            self._projects_by_role = {}
+            self._member_projects = {}
+
+        # Task labels include their project's title
+        versions = self._versions()
+        if self._tasks_version != versions:
+            self._tasks_version = versions
+            self._user_tasks = {}
+            self._project_tasks = {}
+
+    async def projects(
+        self, current: str, member: Optional[discord.Member] = None
+    ) -> List[app_commands.Choice[str]]:
+        """
+        Get the projects matching the input.
+        If a member is given, only the projects they can access are included (Senate can access all).
+        """
+
+        self._check_versions()
+        versions = self._versions()
+
+        if member is None or "Senate" in [r.name for r in member.roles]:
+            index = self._all_projects
+            if index is None:
+                projects = await self.db.list_all_projects()
+                index = TextIndex((p.title, p.title) for p in projects)
+                if self._versions() == versions:
+                    self._all_projects = index
+        else:
+            roles = tuple(sorted(r.id for r in member.roles))
+            index = self._member_projects.get(roles)
+            if index is None:
+                projects_by_role = self._projects_by_role
+                if not projects_by_role:
+                    projects_by_role = {}
+                    for p in await self.db.list_all_projects():
+                        projects_by_role.setdefault(p.role, []).append(p)
+                index = TextIndex(
+                    (p.title, p.title)
+                    for role in roles
+                    for p in projects_by_role.get(role, ())
+                )
+                if self._versions() == versions:
+                    self._projects_by_role = projects_by_role
+                    self._member_projects[roles] = index
+
+        return _choices(index.search(current))
+
+    async def user_tasks(
+        self, user_id: int, current: str
+    ) -> List[app_commands.Choice[str]]:
+        """
+        Get the user's tasks matching the input, labelled with their project's title.
+        Choice values are in the form `project_id:task_id`.
+        """
+
+        self._check_versions()
+        versions = self._versions()
+
+        index = self._user_tasks.get(user_id)
+        if index is None:
+            tasks = await self.db.list_user_tasks(user_id)
+            entries = []
+            for task in tasks:
+                project = await self.db.fetch_project_by_id(task.project_id)
+                if project is None:
+                    continue
+                entries.append(
+                    (f"{project.title} - {task.title}", f"{task.project_id}:{task.id}")
+                )
+            index = TextIndex(entries)
+            if self._versions() == versions:
+                self._user_tasks[user_id] = index
+
+        return _choices(index.search(current))
+
+    async def project_tasks(
+        self, project_title: str, current: str
+    ) -> List[app_commands.Choice[str]]:
+        """
+        Get the tasks of a project matching the input, by title.
+        """
+
+        self._check_versions()
+        versions = self._versions()
+
+        project = await self.db.fetch_project(project_title)
+        if project is None:
+            return []
+
+        index = self._project_tasks.get(project.id)
+        if index is None:
+            tasks = await self.db.list_project_tasks(project.id)
+            index = TextIndex((task.title, task.title) for task in tasks)
+            if self._versions() == versions:
+                self._project_tasks[project.id] = index
+
+        return _choices(index.search(current))
@@ -1,76 +1,126 @@
+import asyncio
 import datetime
 import aiosqlite
-from typing import List, Optional
-from .models import Project, Task, User
+from typing import Dict, List, NamedTuple, Optional, Tuple
+from .models import Project, Task, TaskSheet, User
+from .migrations import migrate
+
+
+class _ProjectIndex(NamedTuple):
+    by_id: Dict[int, Project]
+    by_title: Dict[str, Project]
+    by_github_url: Dict[str, Project]
 
 
 class Database:
     """
     Class for all interactions with the database.
+
+    A single connection is kept open for the bot's lifetime, so queries don't pay for
+    opening the database file and starting a new aiosqlite worker thread every time.
+
+    Projects are read through an in-process cache indexed by id, title and github url,
+    since they are looked up on almost every command and autocomplete but rarely change.
+    The cache is dropped by every method that writes to the projects table.
+    The cached Project objects are shared, so callers must not modify them.
     """
 
     def __init__(self):
         self.db_path = "./data/crux.db"
-
+        self.conn: Optional[aiosqlite.Connection] = None
+        self._connect_lock = asyncio.Lock()
+
+        self._projects: Optional[_ProjectIndex] = None
+
+        # Bumped whenever projects, or the set of tasks (not their status), change,
+        # so caches built on top of the database know when to rebuild
+        self.projects_version = 0
+        self.tasks_version = 0
+
+    async def connect(self) -> aiosqlite.Connection:
+        """
+        Get the database connection, opening it and bringing the schema up to date on first use.
+        """
+
+        if self.conn is not None:
+            return self.conn
+
+        async with self._connect_lock:
+            if self.conn is None:
+                conn = await aiosqlite.connect(self.db_path, cached_statements=256)
+                # WAL lets reads run alongside a write, and with it synchronous=NORMAL
+                # only syncs at checkpoints while staying safe against corruption
+                await conn.execute("PRAGMA journal_mode = WAL;")
+                await conn.execute("PRAGMA synchronous = NORMAL;")
+                await conn.execute("PRAGMA cache_size = -16000;")  # 16 MB
+                await conn.execute("PRAGMA temp_store = MEMORY;")
+                await conn.execute("PRAGMA foreign_keys = ON;")
+                # Migrate before anything else can use the connection
+                await migrate(conn)
+                self.conn = conn
+        return self.conn
+
+    async def close(self) -> None:
+        if self.conn is not None:
+            await self.conn.close()
+            self.conn = None
+
+    # Opening the database creates or migrates its tables
     async def create_tables(self):
-        async with aiosqlite.connect(self.db_path) as conn:
-            await conn.execute(
-                """
-                CREATE TABLE IF NOT EXISTS projects (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    title TEXT NOT NULL,
-                    role BIGINT NOT NULL,
-                    channel BIGINT NOT NULL,
-                    github TEXT NOT NULL,
-                    description TEXT NOT NULL,
-                    webhook_id BIGINT
-                );
-            """
-            )
-
-            await conn.execute(
-                """
-                CREATE TABLE IF NOT EXISTS tasks (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    title TEXT NOT NULL,
-                    description TEXT NOT NULL,
-                    project_id BIGINT NOT NULL,
-                    deadline BIGINT NOT NULL,
-                    status TEXT NOT NULL,
-                    domain TEXT NOT NULL,
-                    assignee BIGINT NOT NULL,
-                    reminder BIGINT
-                );
-            """
-            )
-
-            await conn.execute(
-                """
-                CREATE TABLE IF NOT EXISTS users (
-                    id BIGINT PRIMARY KEY NOT NULL,
-                    name TEXT NOT NULL,
-                    github TEXT,
-                    email TEXT,
-                    token TEXT
-                );
-            """
-            )
-            await conn.commit()
+        await self.connect()
 
     async def fetchone(self, query: str, *args):
-        async with aiosqlite.connect(self.db_path) as conn:
-            data = await conn.execute(query, args)
-            return await data.fetchone()
+        conn = await self.connect()
+        async with conn.execute(query, args) as cursor:
+            return await cursor.fetchone()
 
     async def fetchall(self, query: str, *args):
-        async with aiosqlite.connect(self.db_path) as conn:
-            data = await conn.execute(query, args)
-            return await data.fetchall()
+        conn = await self.connect()
+        async with conn.execute(query, args) as cursor:
+            return await cursor.fetchall()
+
+    # Returns the id of the last inserted row
+    async def execute(self, query: str, *args) -> Optional[int]:
+        conn = await self.connect()
+        async with conn.execute(query, args) as cursor:
+            await conn.commit()
+            return cursor.lastrowid
+
+    async def _load_projects(self) -> _ProjectIndex:
+        """
+        Get every project indexed by id, title and github url, loading them into the cache if needed.
+        """
+
+        if self._projects is not None:
+            return self._projects
+
+        version = self.projects_version
+        data = await self.fetchall("SELECT * FROM projects ORDER BY id;")
+
+        index = _ProjectIndex({}, {}, {})
+        for row in data:
+            project = Project(
+                id=row[0],
+                title=row[1],
+                role=row[2],
+                channel=row[3],
+                github_url=row[4],
+                description=row[5],
+                webhook_id=row[6],
+            )
+            index.by_id[project.id] = project
+            # Same as a query without ORDER BY, the oldest project wins on duplicates
+            index.by_title.setdefault(project.title, project)
+            index.by_github_url.setdefault(project.github_url, project)
 
-    async def execute(self, query: str, *args):
-        async with aiosqlite.connect(self.db_path) as conn:
-            await conn.execute(query, args)
-            return await conn.commit()
+        # Don't cache what may be stale if the projects were written to while loading
+        if version == self.projects_version:
+            self._projects = index
+        return index
+
+    def _invalidate_projects(self) -> None:
+        self._projects = None
+        self.projects_version += 1
 
     # Creating a new project
     async def create_project(self, project: Project) -> None:
@@ -85,8 +135,9 @@ class Database:
             project.github_url,
             project.description,
         )
+        self._invalidate_projects()
 
-    # Deleting an existing project (using project id)
+    # Deleting an existing project (using project id), its tasks are deleted along with it
     async def delete_project(self, project_id: int) -> None:
         await self.execute(
             """
@@ -94,33 +145,23 @@ class Database:
                 """,
             project_id,
         )
-
-        await self.execute(
-            """
-                DELETE FROM tasks WHERE project_id = ?;
-                """,
-            project_id,
-        )
+        self._invalidate_projects()
+        self.tasks_version += 1
 
     # Fetch project using its name
     async def fetch_project(self, project_name: str) -> Optional[Project]:
-        data = await self.fetchone(
-            "SELECT * FROM projects WHERE title = ?;",
-            project_name,
-        )
+        projects = await self._load_projects()
+        return projects.by_title.get(project_name)
 
-        if data is None:
-            return None
+    # Fetch project using its id
+    async def fetch_project_by_id(self, project_id: int) -> Optional[Project]:
+        projects = await self._load_projects()
+        return projects.by_id.get(project_id)
 
-        return Project(
-            id=data[0],
-            title=data[1],
-            role=data[2],
-            channel=data[3],
-            github_url=data[4],
-            description=data[5],
-            webhook_id=data[6],
-        )
+    # Fetch project using its github repo url
+    async def fetch_project_by_github_url(self, github_url: str) -> Optional[Project]:
+        projects = await self._load_projects()
+        return projects.by_github_url.get(github_url)
 
     # Set project webhook id
     async def set_project_webhook_id(self, project_id: int, webhook_id: int) -> None:
@@ -132,27 +173,16 @@ class Database:
             webhook_id,
             project_id,
         )
+        self._invalidate_projects()
 
     # List all existing projects
     async def list_all_projects(self) -> List[Project]:
-        data = await self.fetchall("SELECT * FROM projects;")
+        projects = await self._load_projects()
+        return list(projects.by_id.values())
 
-        return [
-            Project(
-                id=project[0],
-                title=project[1],
-                role=project[2],
-                channel=project[3],
-                github_url=project[4],
-                description=project[5],
-                webhook_id=project[6],
-            )
-            for project in data
-        ]
-
-    # Create task
-    async def create_task(self, task: Task) -> None:
-        await self.execute(
+    # Create task, returns its id
+    async def create_task(self, task: Task) -> int:
+        task.id = await self.execute(
             """
                 INSERT INTO tasks (title, description, project_id, deadline, status, domain, assignee, reminder)
                 VALUES (?, ?, ?, ?, ?, ?, ?, ?);
@@ -166,6 +196,8 @@ class Database:
             task.assignee,
             task.reminder,
         )
+        self.tasks_version += 1
+        return task.id
 
     # List all tasks associated with a particular project
     async def list_project_tasks(
@@ -205,6 +237,62 @@ class Database:
             for task in data
         ]
 
+    # List the tasks of every project in one query, keyed by project id (projects without tasks included)
+    async def list_tasks_by_project(self) -> Dict[int, List[Task]]:
+        data = await self.fetchall(
+            """
+                SELECT projects.id, tasks.* FROM projects
+                LEFT JOIN tasks ON tasks.project_id = projects.id
+                ORDER BY projects.id, tasks.id;
+                """
+        )
+
+        tasks_by_project: Dict[int, List[Task]] = {}
+        for row in data:
+            project_tasks = tasks_by_project.setdefault(row[0], [])
+            if row[1] is not None:
+                project_tasks.append(
+                    Task(
+                        id=row[1],
+                        title=row[2],
+                        description=row[3],
+                        project_id=row[4],
+                        deadline=datetime.datetime.fromtimestamp(row[5]),
+                        status=row[6],
+                        domain=row[7],
+                        assignee=row[8],
+                        reminder=row[9],
+                    )
+                )
+        return tasks_by_project
+
+    # Get the task sheet messages of every project, keyed by project id
+    async def list_task_sheets(self) -> Dict[int, TaskSheet]:
+        data = await self.fetchall("SELECT * FROM task_sheets;")
+
+        return {
+            row[0]: TaskSheet(
+                project_id=row[0],
+                channel=row[1],
+                message_ids=[int(i) for i in row[2].split(",")],
+                content_hash=row[3],
+            )
+            for row in data
+        }
+
+    # Save a project's task sheet messages
+    async def set_task_sheet(self, sheet: TaskSheet) -> None:
+        await self.execute(
+            """
+                INSERT OR REPLACE INTO task_sheets (project_id, channel, message_ids, content_hash)
+                VALUES (?, ?, ?, ?);
+                """,
+            sheet.project_id,
+            sheet.channel,
+            ",".join(str(i) for i in sheet.message_ids),
+            sheet.content_hash,
+        )
+
     # Delete task
     async def delete_task(self, task_id: int) -> None:
         await self.execute(
@@ -213,6 +301,7 @@ class Database:
                 """,
             task_id,
         )
+        self.tasks_version += 1
 
     # Set task status
     async def set_task_status(self, task_id: int, status: str) -> None:
@@ -236,6 +325,61 @@ class Database:
             task_id,
         )
 
+    # Mark the reminders of many tasks as sent
+    async def clear_task_reminders(self, task_ids: List[int]) -> None:
+        await self.execute(
+            f"""
+                UPDATE tasks SET reminder = NULL
+                WHERE id IN ({', '.join('?' * len(task_ids))});
+                """,
+            *task_ids,
+        )
+
+    # List the tasks with a reminder left to send and their assignee, soonest reminder first
+    async def list_pending_reminders(
+        self, task_ids: Optional[List[int]] = None
+    ) -> List[Tuple[Task, Optional[User]]]:
+        # Matches the tasks_reminder_at partial index, which also gives the order
+        query = """
+            SELECT tasks.*, users.* FROM tasks
+            LEFT JOIN users ON users.id = tasks.assignee
+            WHERE tasks.reminder IS NOT NULL AND tasks.status != 'Completed'
+            AND tasks.deadline > ?
+            """
+        args = [datetime.datetime.now().timestamp()]
+        if task_ids is not None:
+            query += f" AND tasks.id IN ({', '.join('?' * len(task_ids))})"
+            args.extend(task_ids)
+        query += " ORDER BY tasks.deadline - tasks.reminder;"
+
+        data = await self.fetchall(query, *args)
+
+        return [
+            (
+                Task(
+                    id=row[0],
+                    title=row[1],
+                    description=row[2],
+                    project_id=row[3],
+                    deadline=datetime.datetime.fromtimestamp(row[4]),
+                    status=row[5],
+                    domain=row[6],
+                    assignee=row[7],
+                    reminder=row[8],
+                ),
+                User(
+                    id=row[9],
+                    name=row[10],
+                    github=row[11],
+                    email=row[12],
+                    token=row[13],
+                )
+                if row[9] is not None
+                else None,
+            )
+            for row in data
+        ]
+
     # Get all tasks of a user
     async def list_user_tasks(self, user_id: int) -> List[Task]:
         data = await self.fetchall(
@@ -321,3 +465,105 @@ class Database:
             email=data[3],
             token=data[4],
         )
+
+    # Queue an email to be retried
+    async def add_outbox_mail(
+        self, recipient: str, message: bytes, next_attempt: float, error: str
+    ) -> int:
+        return await self.execute(
+            """
+                INSERT INTO mail_outbox (recipient, message, attempts, next_attempt, last_error)
+                VALUES (?, ?, 1, ?, ?);
+                """,
+            recipient,
+            message,
+            next_attempt,
+            error,
+        )
+
+    # List the emails due to be retried, as (id, recipient, message, attempts)
+    async def list_due_outbox_mail(self, now: float) -> List[Tuple[int, str, bytes, int]]:
+        return await self.fetchall(
+            """
+                SELECT id, recipient, message, attempts FROM mail_outbox
+                WHERE next_attempt <= ? ORDER BY next_attempt;
+                """,
+            now,
+        )
+
+    # Get when the next email is due to be retried
+    async def fetch_next_outbox_attempt(self) -> Optional[float]:
+        data = await self.fetchone("SELECT MIN(next_attempt) FROM mail_outbox;")
+        return data[0]
+
+    # Count the emails waiting to be retried
+    async def count_outbox_mail(self) -> int:
+        data = await self.fetchone("SELECT COUNT(*) FROM mail_outbox;")
+        return data[0]
+
+    # Record another failed attempt at sending an email
+    async def reschedule_outbox_mail(
+        self, mail_id: int, next_attempt: float, error: str
+    ) -> None:
+        await self.execute(
+            """
+                UPDATE mail_outbox SET attempts = attempts + 1, next_attempt = ?, last_error = ?
+                WHERE id = ?;
+                """,
+            next_attempt,
+            error,
+            mail_id,
+        )
+
+    # Remove an email that was sent or given up on
+    async def delete_outbox_mail(self, mail_id: int) -> None:
+        await self.execute(
+            """
+                DELETE FROM mail_outbox WHERE id = ?;
+                """,
+            mail_id,
+        )
+
+    # Record a webhook delivery id
+    async def add_webhook_delivery(self, delivery_id: str, received: float) -> None:
+        await self.execute(
+            """
+                INSERT OR REPLACE INTO webhook_deliveries (id, received)
+                VALUES (?, ?);
+                """,
+            delivery_id,
+            received,
+        )
+
+    # Forget a webhook delivery id, so the delivery is processed if it comes again
+    async def delete_webhook_delivery(self, delivery_id: str) -> None:
+        await self.execute(
+            """
+                DELETE FROM webhook_deliveries WHERE id = ?;
+                """,
+            delivery_id,
+        )
+
+    # List the most recent webhook delivery ids received after a time, as (id, received), oldest first
+    async def list_webhook_deliveries(
+        self, since: float, limit: int
+    ) -> List[Tuple[str, float]]:
+        return await self.fetchall(
+            """
+                SELECT * FROM (
+                    SELECT id, received FROM webhook_deliveries WHERE received > ?
+                    ORDER BY received DESC LIMIT ?
+                ) ORDER BY received;
+                """,
+            since,
+            limit,
+        )
+
+    # Delete the webhook delivery ids received before a time
+    async def delete_webhook_deliveries(self, before: float) -> None:
+        await self.execute(
+            """
+                DELETE FROM webhook_deliveries WHERE received <= ?;
+                """,
+            before,
+        )
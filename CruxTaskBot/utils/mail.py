@@ -0,0 +1,279 @@
+import time
+import email
+import email.policy
+import asyncio
+import traceback
+import aiosmtplib
+from email.message import EmailMessage
+from typing import Dict, Optional
+from .database import Database
+from .metrics import Latencies
+
+
+class PermanentMailError(Exception):
+    """
+    Raised when the SMTP server rejects an email in a way that retrying won't fix.
+    """
+
+
+def _is_permanent(error: Exception) -> bool:
+    # 5xx replies are permanent, 4xx replies and connection problems are worth retrying
+    if isinstance(error, aiosmtplib.SMTPRecipientsRefused):
+        return all(r.code >= 500 for r in error.recipients)
+    if isinstance(error, aiosmtplib.SMTPAuthenticationError):
+        return False  # Usually a misconfiguration that gets fixed, keep the email
+    if isinstance(error, aiosmtplib.SMTPResponseException):
+        return error.code >= 500
+    return False
+
+
+class MailMetrics:
+    """
+    Delivery counters and latencies of a `Mailer`.
+
+    Attributes:
+        sent (int): Emails delivered, including retried ones.
+        failed_attempts (int): Attempts that failed, each failed email counts once per attempt.
+        dropped (int): Emails given up on, after a permanent error or too many attempts.
+        latencies (Latencies): How long delivering an email takes.
+    """
+
+    def __init__(self) -> None:
+        self.sent = 0
+        self.failed_attempts = 0
+        self.dropped = 0
+        self.latencies = Latencies()
+
+    def record_sent(self, latency: float) -> None:
+        self.sent += 1
+        self.latencies.record(latency)
+
+
+class Mailer:
+    """
+    Delivers emails through a small pool of SMTP connections.
+
+    Connections are opened on demand and reopened whenever the server drops them.
+    At most `pool_size` emails are sent at once, the rest wait for a free connection in order.
+    Emails that fail to send are persisted in the database and retried with exponential backoff,
+    so a slow or unreachable server never blocks or loses a reminder.
+
+    Args:
+        db (Database): The bot's database, holding the retry queue.
+        hostname (str): The SMTP server's hostname.
+        port (int): The SMTP server's port.
+        sender (str): The address emails are sent from.
+        username (str): The SMTP username, if the server needs authentication.
+        password (str): The SMTP password, without one the mailer doesn't log in.
+        pool_size (int): The maximum number of open connections.
+        timeout (float): The number of seconds to wait for the server on every step.
+        max_attempts (int): The number of attempts after which an email is given up on.
+        backoff (float): The number of seconds before the first retry, doubled for every retry after.
+        max_backoff (float): The maximum number of seconds between retries.
+    """
+
+    def __init__(
+        self,
+        db: Database,
+        hostname: str,
+        port: int,
+        sender: str,
+        username: Optional[str] = None,
+        password: Optional[str] = None,
+        pool_size: int = 2,
+        timeout: float = 30,
+        max_attempts: int = 8,
+        backoff: float = 60,
+        max_backoff: float = 60 * 60,
+    ) -> None:
+        self.db = db
+        self.hostname = hostname
+        self.port = port
+        self.sender = sender
+        self.username = username
+        self.password = password
+        self.timeout = timeout
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+
+        self.metrics = MailMetrics()
+        # Emails waiting to be retried, refreshed by the retry loop
+        self.outbox_size = 0
+
+        self._pool: asyncio.Queue = asyncio.Queue()
+        for _ in range(pool_size):
+            self._pool.put_nowait(self._new_connection())
+        self._wake = asyncio.Event()
+        self._retry_task: Optional[asyncio.Task] = None
+
+    def _new_connection(self) -> aiosmtplib.SMTP:
+        return aiosmtplib.SMTP(
+            hostname=self.hostname, port=self.port, timeout=self.timeout
+        )
+
+    async def _connect(self, smtp: aiosmtplib.SMTP) -> None:
+        await smtp.connect()
+        # Only log in when a password is set, local test servers don't support authentication
+        if not (self.username and self.password):
+            return
+        if not smtp.supports_extension("auth"):
+            print(
+                f"SMTP server {self.hostname} doesn't support authentication, "
+                "unset EMAIL_PASSWORD to send without logging in"
+            )
+            # A misconfiguration like a wrong password, keep the email until it's fixed
+            raise aiosmtplib.SMTPException("AUTH is not supported by the server")
+        await smtp.login(self.username, self.password)
+
+    def start(self) -> None:
+        if self._retry_task is None:
+            self._retry_task = asyncio.create_task(self._retry_loop())
+
+    async def close(self) -> None:
+        if self._retry_task is not None:
+            self._retry_task.cancel()
+            self._retry_task = None
+
+        while not self._pool.empty():
+            smtp = self._pool.get_nowait()
+            if smtp.is_connected:
+                try:
+                    await smtp.quit()
+                except aiosmtplib.SMTPException:
+                    smtp.close()
+
+    def message(self, to_email: str, subject: str, content: str) -> EmailMessage:
+        message = EmailMessage()
+        message["From"] = self.sender
+        message["To"] = to_email
+        message["Subject"] = subject
+        message.set_content(content)
+        return message
+
+    async def _deliver(self, message: EmailMessage) -> None:
+        """
+        Send an email on a pooled connection, reconnecting once if the connection went stale.
+
+        Raises:
+            PermanentMailError: If the server rejected the email for good.
+            Exception: Any other error, the email may be retried later.
+        """
+
+        smtp = await self._pool.get()
+        try:
+            for attempt in range(2):
+                try:
+                    if not smtp.is_connected:
+                        await self._connect(smtp)
+                    await smtp.send_message(message)
+                    return
+                except aiosmtplib.SMTPServerDisconnected:
+                    # Idle connections get dropped by the server, try once more on a fresh one
+                    smtp.close()
+                    smtp = self._new_connection()
+                    if attempt == 1:
+                        raise
+                except Exception as e:
+                    if smtp.is_connected:
+                        smtp.close()
+                    smtp = self._new_connection()
+                    if _is_permanent(e):
+                        raise PermanentMailError(str(e)) from e
+                    raise
+        finally:
+            self._pool.put_nowait(smtp)
+
+    async def send(self, message: EmailMessage) -> bool:
+        """
+        Send an email. If it can't be sent right now, it is queued to be retried later.
+
+        Returns:
+            bool: True if the email was sent or queued, False if the server rejected it for good.
+        """
+
+        start = time.perf_counter()
+        try:
+            await self._deliver(message)
+        except PermanentMailError as e:
+            print(f"Email to {message['To']} was rejected: {e}")
+            self.metrics.failed_attempts += 1
+            self.metrics.dropped += 1
+            return False
+        except Exception as e:
+            self.metrics.failed_attempts += 1
+            await self.db.add_outbox_mail(
+                message["To"],
+                message.as_bytes(),
+                time.time() + self.backoff,
+                f"{type(e).__name__}: {e}",
+            )
+            self.outbox_size += 1
+            self._wake.set()
+            return True
+
+        self.metrics.record_sent(time.perf_counter() - start)
+        return True
+
+    async def retry_due(self) -> None:
+        """
+        Retry every queued email that is due.
+        """
+
+        for mail_id, _, data, attempts in await self.db.list_due_outbox_mail(
+            time.time()
+        ):
+            message = email.message_from_bytes(data, policy=email.policy.default)
+            start = time.perf_counter()
+            try:
+                await self._deliver(message)
+            except Exception as e:
+                self.metrics.failed_attempts += 1
+                if isinstance(e, PermanentMailError) or attempts >= self.max_attempts:
+                    print(
+                        f"Giving up on email {mail_id} after {attempts} attempts: {e}"
+                    )
+                    self.metrics.dropped += 1
+                    await self.db.delete_outbox_mail(mail_id)
+                else:
+                    delay = min(self.backoff * 2**attempts, self.max_backoff)
+                    await self.db.reschedule_outbox_mail(
+                        mail_id, time.time() + delay, f"{type(e).__name__}: {e}"
+                    )
+                continue
+
+            self.metrics.record_sent(time.perf_counter() - start)
+            await self.db.delete_outbox_mail(mail_id)
+
+    async def _retry_loop(self) -> None:
+        while True:
+            try:
+                await self.retry_due()
+                self.outbox_size = await self.db.count_outbox_mail()
+                next_attempt = await self.db.fetch_next_outbox_attempt()
+            except Exception:
+                traceback.print_exc()
+                next_attempt = time.time() + self.backoff
+
+            timeout = (
+                None if next_attempt is None else max(next_attempt - time.time(), 0)
+            )
+            self._wake.clear()
+            try:
+                await asyncio.wait_for(self._wake.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+
+    def metrics_dict(self) -> Dict[str, float]:
+        """
+        Get the mail metrics, named as Prometheus metrics.
+        """
+
+        return {
+            "crux_mail_sent_total": self.metrics.sent,
+            "crux_mail_failed_attempts_total": self.metrics.failed_attempts,
+            "crux_mail_dropped_total": self.metrics.dropped,
+            "crux_mail_outbox_size": self.outbox_size,
+            "crux_mail_connections_idle": self._pool.qsize(),
+            **self.metrics.latencies.metrics("crux_mail_delivery_seconds"),
+        }
@@ -0,0 +1,47 @@
+from collections import deque
+from typing import Deque, Dict
+
+
+class Latencies:
+    """
+    Tracks how long an operation takes, for reporting as a Prometheus summary.
+
+    Args:
+        window (int): The number of most recent latencies quantiles are computed from.
+    """
+
+    def __init__(self, window: int = 1000) -> None:
+        self.count = 0
+        self.sum = 0.0
+        self.recent: Deque[float] = deque(maxlen=window)
+
+    def record(self, seconds: float) -> None:
+        self.count += 1
+        self.sum += seconds
+        self.recent.append(seconds)
+
+    def quantile(self, q: float) -> float:
+        if not self.recent:
+            return 0.0
+        ordered = sorted(self.recent)
+        return ordered[min(int(q * len(ordered)), len(ordered) - 1)]
+
+    def metrics(self, name: str) -> Dict[str, float]:
+        """
+        Get the summary's metrics, named after `name`.
+        """
+
+        return {
+            f'{name}{{quantile="0.5"}}': self.quantile(0.5),
+            f'{name}{{quantile="0.95"}}': self.quantile(0.95),
+            f"{name}_sum": self.sum,
+            f"{name}_count": self.count,
+        }
+
+
+def format_metrics(metrics: Dict[str, float]) -> str:
+    """
+    Format metrics in the Prometheus text format.
+    """
+
+    return "".join(f"{name} {value}\n" for name, value in metrics.items())
@@ -0,0 +1,211 @@
+import aiosqlite
+from typing import Awaitable, Callable, List
+
+
+async def create_tables(conn: aiosqlite.Connection) -> None:
+    """
+    The original schema. Databases created before migrations existed already have it.
+    """
+
+    await conn.execute("""
+        CREATE TABLE IF NOT EXISTS projects (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            title TEXT NOT NULL,
+            role BIGINT NOT NULL,
+            channel BIGINT NOT NULL,
+            github TEXT NOT NULL,
+            description TEXT NOT NULL,
+            webhook_id BIGINT
+        );
+    """)
+
+    await conn.execute("""
+        CREATE TABLE IF NOT EXISTS tasks (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            title TEXT NOT NULL,
+            description TEXT NOT NULL,
+            project_id BIGINT NOT NULL,
+            deadline BIGINT NOT NULL,
+            status TEXT NOT NULL,
+            domain TEXT NOT NULL,
+            assignee BIGINT NOT NULL,
+            reminder BIGINT
+        );
+    """)
+
+    await conn.execute("""
+        CREATE TABLE IF NOT EXISTS users (
+            id BIGINT PRIMARY KEY NOT NULL,
+            name TEXT NOT NULL,
+            github TEXT,
+            email TEXT,
+            token TEXT
+        );
+    """)
+
+
+async def add_indexes_and_foreign_keys(conn: aiosqlite.Connection) -> None:
+    """
+    Index the columns tasks, users and projects are looked up by, and make tasks
+    reference their project so they are deleted along with it.
+    """
+
+    # SQLite can't add a foreign key to an existing table, so tasks is rebuilt
+    async with conn.execute(
+        "SELECT seq FROM sqlite_sequence WHERE name = 'tasks';"
+    ) as cursor:
+        row = await cursor.fetchone()
+    last_task_id = row[0] if row is not None else 0
+
+    await conn.execute("""
+        CREATE TABLE tasks_new (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            title TEXT NOT NULL,
+            description TEXT NOT NULL,
+            project_id BIGINT NOT NULL REFERENCES projects (id) ON DELETE CASCADE,
+            deadline BIGINT NOT NULL,
+            status TEXT NOT NULL,
+            domain TEXT NOT NULL,
+            assignee BIGINT NOT NULL,
+            reminder BIGINT
+        );
+    """)
+    # Tasks of deleted projects were already unreachable
+    await conn.execute("""
+        INSERT INTO tasks_new
+        SELECT * FROM tasks WHERE project_id IN (SELECT id FROM projects);
+    """)
+    await conn.execute("DROP TABLE tasks;")
+    await conn.execute("ALTER TABLE tasks_new RENAME TO tasks;")
+    # Don't reuse the ids of deleted tasks. The rebuilt table has no sequence row
+    # if no tasks were copied, and sqlite_sequence has no unique key to upsert on
+    await conn.execute("DELETE FROM sqlite_sequence WHERE name = 'tasks';")
+    await conn.execute(
+        """
+        INSERT INTO sqlite_sequence (name, seq)
+        SELECT 'tasks', MAX(?, IFNULL(MAX(id), 0)) FROM tasks;
+    """,
+        (last_task_id,),
+    )
+
+    await conn.execute("CREATE INDEX tasks_assignee ON tasks (assignee);")
+    await conn.execute("CREATE INDEX tasks_project_id ON tasks (project_id);")
+    await conn.execute("CREATE UNIQUE INDEX users_token ON users (token);")
+    await conn.execute("CREATE INDEX projects_title ON projects (title);")
+
+
+async def add_reminder_index(conn: aiosqlite.Connection) -> None:
+    """
+    Index the tasks with a reminder left to send by when it is due.
+    """
+
+    await conn.execute("""
+        CREATE INDEX tasks_reminder_at ON tasks (deadline - reminder)
+        WHERE reminder IS NOT NULL AND status != 'Completed';
+    """)
+
+
+async def add_mail_outbox(conn: aiosqlite.Connection) -> None:
+    """
+    Emails that failed to send and are waiting to be retried.
+    """
+
+    await conn.execute("""
+        CREATE TABLE mail_outbox (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            recipient TEXT NOT NULL,
+            message BLOB NOT NULL,
+            attempts INTEGER NOT NULL,
+            next_attempt REAL NOT NULL,
+            last_error TEXT
+        );
+    """)
+    await conn.execute(
+        "CREATE INDEX mail_outbox_next_attempt ON mail_outbox (next_attempt);"
+    )
+
+
+async def add_task_sheets(conn: aiosqlite.Connection) -> None:
+    """
+    The pinned task sheet message(s) of every project, with the hash of their content.
+    """
+
+    await conn.execute("""
+        CREATE TABLE task_sheets (
+            project_id INTEGER PRIMARY KEY REFERENCES projects (id) ON DELETE CASCADE,
+            channel BIGINT NOT NULL,
+            message_ids TEXT NOT NULL,
+            content_hash TEXT NOT NULL
+        );
+    """)
+
+
+async def add_webhook_deliveries(conn: aiosqlite.Connection) -> None:
+    """
+    The ids of recently received GitHub webhook deliveries, to ignore redeliveries.
+    """
+
+    await conn.execute("""
+        CREATE TABLE webhook_deliveries (
+            id TEXT PRIMARY KEY,
+            received REAL NOT NULL
+        );
+    """)
+    await conn.execute(
+        "CREATE INDEX webhook_deliveries_received ON webhook_deliveries (received);"
+    )
+
+
+# Every schema change, in order. Never edit or reorder a migration once it has been released,
+# add a new one instead. A database's version is the number of migrations applied to it.
+MIGRATIONS: List[Callable[[aiosqlite.Connection], Awaitable[None]]] = [
+    create_tables,
+    add_indexes_and_foreign_keys,
+    add_reminder_index,
+    add_mail_outbox,
+    add_task_sheets,
+    add_webhook_deliveries,
+]
+
+
+async def migrate(conn: aiosqlite.Connection) -> int:
+    """
+    Bring the database's schema up to date, tracking its version with `PRAGMA user_version`.
+    Each migration runs in its own transaction, so a failed one leaves the database as it was.
+
+    Args:
+        conn (aiosqlite.Connection): The database connection.
+
+    Returns:
+        int: The number of migrations applied.
+    """
+
+    async with conn.execute("PRAGMA user_version;") as cursor:
+        version = (await cursor.fetchone())[0]
+
+    if version >= len(MIGRATIONS):
+        return 0
+
+    # Foreign keys can only be toggled outside a transaction, and must be off while tables are rebuilt
+    await conn.execute("PRAGMA foreign_keys = OFF;")
+    try:
+        for number, migration in enumerate(MIGRATIONS[version:], start=version + 1):
+            await conn.execute("BEGIN;")
+            try:
+                await migration(conn)
+
+                async with conn.execute("PRAGMA foreign_key_check;") as cursor:
+                    if await cursor.fetchone() is not None:
+                        raise RuntimeError(
+                            f"Migration {number} ({migration.__name__}) broke foreign keys"
+                        )
+
+                await conn.execute(f"PRAGMA user_version = {number};")
+            except BaseException:
+                await conn.rollback()
+                raise
+            await conn.commit()
+    finally:
+        await conn.execute("PRAGMA foreign_keys = ON;")
+
+    return len(MIGRATIONS) - version
@@ -51,3 +51,11 @@ class User:
 
     def __post_init__(self):
         self.token = self.token or uuid.uuid4().hex
+
+
+@dataclass
+class TaskSheet:
+    project_id: int
+    channel: int
+    message_ids: List[int]  # The sheet's messages in order, the first one is pinned
+    content_hash: str  # Hash of the content the messages were last sent or edited with
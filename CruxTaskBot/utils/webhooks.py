@@ -0,0 +1,548 @@
+import os
+import gzip
+import json
+import time
+import zlib
+import asyncio
+import discord
+import traceback
+from discord.ext import commands
+from collections import OrderedDict
+from typing import Any, Dict, Iterator, List, NamedTuple, Optional, Tuple
+from .database import Database
+from .metrics import Latencies
+
+# The GitHub events posted to project channels, the rest are ignored
+EVENT_TYPES = ("issues", "pull_request", "push", "ping")
+
+# Discord's embed limits
+MAX_FIELDS = 25
+MAX_FIELD_NAME = 256
+MAX_FIELD_VALUE = 1024
+MAX_EMBED_LENGTH = 6000
+
+
+class WebhookEvent(NamedTuple):
+    event_type: str
+    data: Dict[str, Any]
+    received: float  # time.perf_counter() when the request arrived
+
+
+def _truncate(text: str, limit: int) -> str:
+    return text if len(text) <= limit else text[: limit - 1] + "…"
+
+
+def build_embed(event_type: str, data: Dict[str, Any]) -> discord.Embed:
+    """
+    Build the embed announcing a GitHub event in its project's channel.
+
+    Args:
+        event_type (str): The event's type, from the X-GitHub-Event header.
+        data (Dict): The event's payload.
+
+    Returns:
+        discord.Embed: The embed.
+    """
+
+    repository = data["repository"]["full_name"]
+    html_url = data["repository"]["html_url"]
+
+    embed = discord.Embed(
+        title=f"New GitHub Event ({event_type}) for {repository}",
+        color=0x7289DA,
+    )
+
+    embed.add_field(
+        name="Repository",
+        value=f"[{repository}]({html_url})",
+        inline=False,
+    )
+
+    if event_type == "issues":
+        issue_title = data["issue"]["title"]
+        issue_url = data["issue"]["html_url"]
+        embed.add_field(
+            name="Issue Title",
+            value=f"[{issue_title}]({issue_url})",
+            inline=False,
+        )
+        action = data["action"]
+        user = data["sender"]["login"]
+        embed.add_field(name="Action", value=f"{action} by {user}", inline=False)
+
+    if event_type == "pull_request":
+        pr_title = data["pull_request"]["title"]
+        pr_url = data["pull_request"]["html_url"]
+        embed.add_field(
+            name="Pull Request Title",
+            value=f"[{pr_title}]({pr_url})",
+            inline=False,
+        )
+        action = data["action"]
+        user = data["sender"]["login"]
+        embed.add_field(name="Action", value=f"{action} by {user}", inline=False)
+
+    if event_type == "push":
+        commits = data["commits"]
+        commit_messages = "\n".join(
+            [
+                f"`{commit['message']}` by `{commit['author']['name']}`"
+                for commit in commits
+            ]
+        )
+        if commits:
+            ref = data.get("ref")
+            if ref:
+                if ref.startswith("refs/heads/"):
+                    branch_name = ref[len("refs/heads/") :]
+                    embed.add_field(
+                        name="Branch", value=f"`{branch_name}`", inline=False
+                    )
+
+            embed.add_field(
+                name="Commits",
+                value=_truncate(commit_messages, MAX_FIELD_VALUE),
+                inline=False,
+            )
+        else:
+            ref = data.get("ref")
+            if ref:
+                if ref.startswith("refs/heads/"):
+                    branch_name = ref[len("refs/heads/") :]
+                    embed.add_field(
+                        name="Branch Created/Updated",
+                        value=f"The branch `{branch_name}` was created or updated.",
+                        inline=False,
+                    )
+
+    return embed
+
+
+def summarize_event(event_type: str, data: Dict[str, Any]) -> Tuple[str, str]:
+    """
+    Summarize a GitHub event as the name and value of an embed field.
+    """
+
+    if event_type == "issues":
+        issue = data["issue"]
+        return (
+            f"Issue {data['action']} by {data['sender']['login']}",
+            f"[{issue['title']}]({issue['html_url']})",
+        )
+
+    if event_type == "pull_request":
+        pr = data["pull_request"]
+        return (
+            f"Pull Request {data['action']} by {data['sender']['login']}",
+            f"[{pr['title']}]({pr['html_url']})",
+        )
+
+    if event_type == "push":
+        ref = data.get("ref") or ""
+        branch_name = (
+            ref[len("refs/heads/") :] if ref.startswith("refs/heads/") else ref
+        )
+        commits = data["commits"]
+        if not commits:
+            return (
+                "Branch Created/Updated",
+                f"The branch `{branch_name}` was created or updated.",
+            )
+        return (
+            f"{len(commits)} commit(s) pushed to {branch_name}",
+            "\n".join(
+                f"`{commit['message']}` by `{commit['author']['name']}`"
+                for commit in commits
+            ),
+        )
+
+    return "Ping", "The webhook is set up."
+
+
+def build_summary_embeds(
+    repository: Dict[str, Any], fields: List[Tuple[str, str]]
+) -> List[discord.Embed]:
+    """
+    Build embeds summarizing several GitHub events of a repository, one field per event.
+    As many embeds as needed are built to stay within Discord's embed limits.
+
+    Args:
+        repository (Dict): The repository of the events, from their payload.
+        fields (List): The name and value summarizing each event, from `summarize_event`.
+    """
+
+    embeds: List[discord.Embed] = []
+    embed: Optional[discord.Embed] = None
+    for name, value in fields:
+        name = _truncate(name, MAX_FIELD_NAME)
+        value = _truncate(value, MAX_FIELD_VALUE)
+
+        if (
+            embed is None
+            or len(embed.fields) >= MAX_FIELDS
+            # Leaving room for the footer
+            or len(embed) + len(name) + len(value) > MAX_EMBED_LENGTH - 32
+        ):
+            embed = discord.Embed(
+                title=f"New GitHub Events for {repository.get('full_name')}",
+                url=repository["html_url"],
+                color=0x7289DA,
+            )
+            embeds.append(embed)
+        embed.add_field(name=name, value=value, inline=False)
+
+    for embed in embeds:
+        embed.set_footer(text=f"{len(embed.fields)} event(s)")
+    return embeds
+
+
+class EventLog:
+    """
+    Appends every accepted GitHub webhook event to a gzipped JSON lines file, for replaying later.
+
+    Events are buffered and written once a second in a background thread, each write adding
+    a gzip member to the file. Once the file grows past `max_bytes` it is rotated like
+    `logging.handlers.RotatingFileHandler` does (`webhooks.jsonl.gz.1`, `.2`, ...),
+    keeping `backups` old files.
+
+    Args:
+        directory (str): The directory to write the log to.
+        max_bytes (int): The size after which the log is rotated.
+        backups (int): The number of rotated logs to keep.
+    """
+
+    def __init__(
+        self, directory: str, max_bytes: int = 16 * 1024 * 1024, backups: int = 5
+    ) -> None:
+        self.path = os.path.join(directory, "webhooks.jsonl.gz")
+        self.max_bytes = max_bytes
+        self.backups = backups
+        self.buffer: List[Dict[str, Any]] = []
+        self._writer: Optional[asyncio.Task] = None
+
+    def start(self) -> None:
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        if self._writer is None:
+            self._writer = asyncio.create_task(self._write_loop())
+
+    async def close(self) -> None:
+        if self._writer is not None:
+            self._writer.cancel()
+            self._writer = None
+        await self.flush()
+
+    def append(
+        self, event_type: str, delivery_id: Optional[str], data: Dict[str, Any]
+    ) -> None:
+        self.buffer.append(
+            {
+                "received": time.time(),
+                "event": event_type,
+                "delivery": delivery_id,
+                "payload": data,
+            }
+        )
+
+    async def flush(self) -> None:
+        if self.buffer:
+            records, self.buffer = self.buffer, []
+            await asyncio.get_running_loop().run_in_executor(None, self._write, records)
+
+    def _write(self, records: List[Dict[str, Any]]) -> None:
+        lines = "".join(json.dumps(record) + "\n" for record in records)
+        with gzip.open(self.path, "at", encoding="utf-8") as f:
+            f.write(lines)
+
+        if os.path.getsize(self.path) >= self.max_bytes:
+            self._rotate()
+
+    def _rotate(self) -> None:
+        for i in range(self.backups - 1, 0, -1):
+            if os.path.exists(f"{self.path}.{i}"):
+                os.replace(f"{self.path}.{i}", f"{self.path}.{i + 1}")
+        if self.backups > 0:
+            os.replace(self.path, f"{self.path}.1")
+        else:
+            os.remove(self.path)
+
+    async def _write_loop(self) -> None:
+        while True:
+            await asyncio.sleep(1)
+            try:
+                await self.flush()
+            except OSError:
+                # Losing some of the log is better than stopping it
+                traceback.print_exc()
+
+
+def read_event_log(path: str) -> Iterator[Dict[str, Any]]:
+    """
+    Read the events of a log written by `EventLog`, oldest first.
+
+    Yields:
+        Dict: The event's `received` time, `event` type, `delivery` id and `payload`.
+    """
+
+    with gzip.open(path, "rt", encoding="utf-8") as f:
+        for line in f:
+            yield json.loads(line)
+
+
+class RecentDeliveries:
+    """
+    The ids of the GitHub webhook deliveries received recently, to drop redeliveries of an event.
+
+    Ids are checked in memory, in insertion order so expired ids are dropped from the front.
+    They are also written to the database and loaded back on startup, so redeliveries
+    are recognized across restarts.
+
+    Args:
+        db (Database): The bot's database.
+        ttl (float): The number of seconds an id is remembered for.
+        max_size (int): The maximum number of ids remembered, the oldest are forgotten first.
+    """
+
+    def __init__(
+        self, db: Database, ttl: float = 24 * 60 * 60, max_size: int = 10000
+    ) -> None:
+        self.db = db
+        self.ttl = ttl
+        self.max_size = max_size
+        self.ids: "OrderedDict[str, float]" = OrderedDict()  # id -> time received
+        self.duplicates = 0
+        self._last_prune = 0.0
+
+    async def load(self) -> None:
+        now = time.time()
+        await self.db.delete_webhook_deliveries(now - self.ttl)
+        self._last_prune = now
+        self.ids = OrderedDict(
+            await self.db.list_webhook_deliveries(now - self.ttl, self.max_size)
+        )
+
+    def _expire(self, now: float) -> None:
+        while self.ids and (
+            len(self.ids) > self.max_size
+            or next(iter(self.ids.values())) <= now - self.ttl
+        ):
+            self.ids.popitem(last=False)
+
+    async def add(self, delivery_id: str) -> bool:
+        """
+        Remember a delivery id.
+
+        Returns:
+            bool: False if the delivery was already received.
+        """
+
+        now = time.time()
+        self._expire(now)
+        if delivery_id in self.ids:
+            self.duplicates += 1
+            return False
+
+        # Remembered before anything is awaited, so a concurrent redelivery is caught too
+        self.ids[delivery_id] = now
+        self._expire(now)
+        try:
+            await self.db.add_webhook_delivery(delivery_id, now)
+        except Exception:
+            self.ids.pop(delivery_id, None)
+            raise
+
+        if now - self._last_prune > 60 * 60:
+            self._last_prune = now
+            await self.db.delete_webhook_deliveries(now - self.ttl)
+        return True
+
+    async def discard(self, delivery_id: str) -> None:
+        """
+        Forget a delivery id, for a delivery that couldn't be processed and should be accepted again.
+        """
+
+        self.ids.pop(delivery_id, None)
+        await self.db.delete_webhook_delivery(delivery_id)
+
+
+class WebhookPipeline:
+    """
+    Posts GitHub webhook events to their project's channel in the background,
+    so the webhook can be acknowledged before Discord is called.
+
+    Bursts are coalesced: the events a repository sends within `window` seconds of its first
+    one are posted together as a single summary message, as soon as the window closes or
+    `max_batch` events are collected.
+
+    Batches are spread over `workers` queues by repository, each drained by its own worker,
+    so events of one repository are posted in the order they arrived while a slow channel
+    only holds up the repositories sharing its worker.
+
+    Args:
+        bot (commands.Bot): The bot.
+        workers (int): The number of workers.
+        max_queue (int): The maximum number of events waiting to be posted.
+        window (float): The number of seconds to collect a repository's events for, 0 to post every event on its own.
+        max_batch (int): The maximum number of events posted together.
+    """
+
+    def __init__(
+        self,
+        bot: commands.Bot,
+        workers: int = 4,
+        max_queue: int = 1000,
+        window: float = 5,
+        max_batch: int = 25,
+    ) -> None:
+        self.bot = bot
+        self.max_queue = max_queue
+        self.window = window
+        self.max_batch = max_batch
+
+        # The open batch of every repository
+        self.batches: Dict[str, List[WebhookEvent]] = {}
+        self.queues: List[asyncio.Queue] = [asyncio.Queue() for _ in range(workers)]
+        self.workers: List[asyncio.Task] = []
+        self.pending = 0  # Events batched or queued
+
+        self.received = 0
+        self.rejected = 0
+        self.failed = 0
+        self.messages = 0
+        self.queue_latencies = Latencies()  # Time spent batched and queued
+        self.latencies = Latencies()  # Time from receiving an event to posting it
+
+    def start(self) -> None:
+        if not self.workers:
+            self.workers = [
+                asyncio.create_task(self._worker(queue)) for queue in self.queues
+            ]
+
+    async def close(self) -> None:
+        for worker in self.workers:
+            worker.cancel()
+        self.workers = []
+
+    def submit(self, event_type: str, data: Dict[str, Any]) -> bool:
+        """
+        Queue an event to be posted.
+
+        Returns:
+            bool: False if too many events are waiting and the event was dropped.
+        """
+
+        if self.pending >= self.max_queue:
+            self.rejected += 1
+            return False
+
+        self.received += 1
+        self.pending += 1
+        html_url = data["repository"]["html_url"]
+        event = WebhookEvent(event_type, data, time.perf_counter())
+
+        batch = self.batches.get(html_url)
+        if batch is not None:
+            batch.append(event)
+            if len(batch) >= self.max_batch:
+                self._flush(html_url, batch)
+        elif self.window > 0 and self.max_batch > 1:
+            batch = self.batches[html_url] = [event]
+            asyncio.get_running_loop().call_later(
+                self.window, self._flush, html_url, batch
+            )
+        else:
+            self._enqueue(html_url, [event])
+
+        return True
+
+    def _flush(self, html_url: str, batch: List[WebhookEvent]) -> None:
+        # The timer of a batch that filled up early finds another batch, or none
+        if self.batches.get(html_url) is batch:
+            del self.batches[html_url]
+            self._enqueue(html_url, batch)
+
+    def _enqueue(self, html_url: str, batch: List[WebhookEvent]) -> None:
+        queue = self.queues[zlib.crc32(html_url.encode()) % len(self.queues)]
+        queue.put_nowait(batch)
+
+    async def handle(self, batch: List[WebhookEvent]) -> None:
+        """
+        Post a repository's events to its project's channel, if the repository belongs to a project.
+        """
+
+        html_url = batch[0].data["repository"]["html_url"]
+        project = await self.bot.db.fetch_project_by_github_url(html_url)
+        if project is None:
+            return
+
+        embeds, events = self._build_embeds(batch)
+        if not embeds:
+            return
+
+        try:
+            ch = self.bot.get_channel(project.channel)
+            if not ch:
+                ch = await self.bot.fetch_channel(project.channel)
+
+            for embed in embeds:
+                await ch.send(embed=embed)
+                self.messages += 1
+        except Exception:
+            self.failed += events
+            raise
+
+    def _build_embeds(
+        self, batch: List[WebhookEvent]
+    ) -> Tuple[List[discord.Embed], int]:
+        """
+        Build the embeds posting a batch of events. Malformed events are skipped and counted
+        as failed, so they don't keep the rest of the batch from being posted.
+
+        Returns:
+            Tuple: The embeds, and the number of events they include.
+        """
+
+        fields = []
+        for event in batch:
+            try:
+                if len(batch) == 1:
+                    return [build_embed(event.event_type, event.data)], 1
+                fields.append(summarize_event(event.event_type, event.data))
+            except (KeyError, IndexError, TypeError, AttributeError) as e:
+                self.failed += 1
+                print(f"Skipping malformed {event.event_type} event: {e!r}")
+
+        if not fields:
+            return [], 0
+        return build_summary_embeds(batch[0].data["repository"], fields), len(fields)
+
+    async def _worker(self, queue: asyncio.Queue) -> None:
+        while True:
+            batch = await queue.get()
+            start = time.perf_counter()
+            for event in batch:
+                self.queue_latencies.record(start - event.received)
+
+            try:
+                await self.handle(batch)
+            except Exception:
+                traceback.print_exc()  # Keep posting the other events
+
+            self.pending -= len(batch)
+            end = time.perf_counter()
+            for event in batch:
+                self.latencies.record(end - event.received)
+
+    def metrics_dict(self) -> Dict[str, float]:
+        """
+        Get the webhook metrics, named as Prometheus metrics.
+        """
+
+        return {
+            "crux_webhook_received_total": self.received,
+            "crux_webhook_rejected_total": self.rejected,
+            "crux_webhook_failed_total": self.failed,
+            "crux_webhook_messages_total": self.messages,
+            "crux_webhook_queue_depth": self.pending,
+            **self.queue_latencies.metrics("crux_webhook_queue_seconds"),
+            **self.latencies.metrics("crux_webhook_latency_seconds"),
+        }
@@ -0,0 +1,80 @@
+"""
+Measures the client's time to first prompt.
+
+The client is started in a fresh interpreter, exactly like `python client/main.py`,
+and stopped as soon as it is about to show the first prompt (after inquirer is imported).
+Runs are made both with a cold banner cache and a warm one.
+
+Usage:
+    python benchmarks/startup.py [runs]
+"""
+
+import os
+import sys
+import time
+import shutil
+import tempfile
+import statistics
+import subprocess
+
+CLIENT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "client")
+
+CHILD = """
+import os, sys, time
+sys.path.insert(0, {client_dir!r})
+import cli_utils
+
+def first_prompt(self, *args, **kwargs):
+    import inquirer  # Needed to render the prompt
+    sys.stdout.write(repr(time.time()))
+    sys.stdout.flush()
+    os._exit(0)
+
+cli_utils.CLIUtils.get_text_input = first_prompt
+
+import main
+main.main()
+"""
+
+
+def time_to_first_prompt(home: str) -> float:
+    env = dict(os.environ, HOME=home, USERPROFILE=home)
+    start = time.time()
+    out = subprocess.run(
+        [sys.executable, "-c", CHILD.format(client_dir=CLIENT_DIR)],
+        env=env,
+        capture_output=True,
+        text=True,
+        check=True,
+    ).stdout
+    return float(out.strip().splitlines()[-1]) - start
+
+
+def report(label: str, samples) -> None:
+    samples = [s * 1000 for s in samples]
+    print(
+        f"{label:<12} min {min(samples):7.1f} ms   "
+        f"median {statistics.median(samples):7.1f} ms   "
+        f"max {max(samples):7.1f} ms"
+    )
+
+
+def main() -> None:
+    runs = int(sys.argv[1]) if len(sys.argv) > 1 else 10
+
+    cold, warm = [], []
+    for _ in range(runs):
+        home = tempfile.mkdtemp()
+        try:
+            cold.append(time_to_first_prompt(home))  # Banner not cached yet
+            warm.append(time_to_first_prompt(home))
+        finally:
+            shutil.rmtree(home, ignore_errors=True)
+
+    print(f"Time to first prompt over {runs} runs:")
+    report("cold cache", cold)
+    report("warm cache", warm)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,9 +1,10 @@
 import os
-import time
-import pyfiglet
-import inquirer
-from yaspin import yaspin
-from colorama import just_fix_windows_console, Fore, Style
+import hashlib
+from pathlib import Path
+
+# The UI libraries are slow to import, so they are only imported when first needed
+
+BANNER_CACHE_DIR = os.path.join(Path.home(), ".imagedcpp", "banners")
 
 
 class CLIUtils:
@@ -13,20 +14,56 @@ class CLIUtils:
     """
 
     def __init__(self) -> None:
+        from colorama import just_fix_windows_console
+
         just_fix_windows_console()
-        self.spinner = yaspin
+
+    def spinner(self, *args, **kwargs):
+        from yaspin import yaspin
+
+        return yaspin(*args, **kwargs)
+
+    def render_title(self, text, font):
+        """
+        Render the title with pyfiglet, caching the result on disk so later runs don't need pyfiglet at all.
+        """
+
+        key = hashlib.sha1(f"{font}:{text}".encode()).hexdigest()
+        cache_path = os.path.join(BANNER_CACHE_DIR, f"{key}.txt")
+        try:
+            with open(cache_path, "r", encoding="utf-8") as f:
+                return f.read()
+        except OSError:
+            pass
+
+        import pyfiglet
+
+        title = pyfiglet.figlet_format(text, font=font)
+        try:
+            os.makedirs(BANNER_CACHE_DIR, exist_ok=True)
+            with open(cache_path, "w", encoding="utf-8") as f:
+                f.write(title)
+        except OSError:
+            pass  # Caching is best effort
+        return title
 
     def display_title(self):
-        title = pyfiglet.figlet_format("Image DC ++", font="big")
+        from colorama import Fore, Style
+
+        title = self.render_title("Image DC ++", font="big")
         print(Fore.RED + title + Style.RESET_ALL)
 
     def get_text_input(self, qname, qmsg):
+        import inquirer
+
         questions = [inquirer.Text(qname, qmsg)]
         answers = inquirer.prompt(questions)
 
         return answers[qname]
 
     def get_multi_choice_input(self, qname, qmsg, choices):
+        import inquirer
+
         questions = [
             inquirer.List(
                 qname,
@@ -38,6 +75,8 @@ class CLIUtils:
         return answers[qname]
 
     def get_path(self, qname, qmsg):
+        import inquirer
+
         questions = [
             inquirer.Path(
                 qname,
@@ -49,6 +88,8 @@ class CLIUtils:
         return os.path.abspath(answers[qname])
 
     def get_selected_items(self, qname, qmsg, choices):
+        import inquirer
+
         questions = [
             inquirer.Checkbox(
                 qname,
@@ -63,6 +104,8 @@ class CLIUtils:
         print("[-] LOG: " + message)
 
     def log_warning(self, message):
+        from colorama import Fore, Style
+
         print(
             "["
             + Fore.YELLOW
@@ -74,6 +117,8 @@ class CLIUtils:
         )
 
     def log_error(self, message):
+        from colorama import Fore, Style
+
         print(
             "["
             + Fore.RED
@@ -85,7 +130,3 @@ class CLIUtils:
             + message
             + Style.RESET_ALL
         )
-        self.wait(0.5)
-
-    def wait(self, seconds=1):
-        time.sleep(seconds)
@@ -2,8 +2,12 @@ import os
 import time
 import imghdr
 import base64
+import requests
 import socketio
+import threading
 from pathlib import Path
+from urllib.parse import quote
+from sync import remote_name
 from socketio.exceptions import ConnectionError as sioConnectionError
 
 
@@ -14,16 +18,54 @@ class SocketIOClient:
 
     def __init__(self, server_url):
         self.server_url = server_url
-        self.sio = socketio.Client()
+        # Reconnect automatically with exponential backoff (1s, 2s, 4s... up to 30s)
+        self.sio = socketio.Client(reconnection_delay=1, reconnection_delay_max=30)
+        self.closing = False  # Set when the disconnect was requested by us
+        # The name the server gave us, may differ from the requested one
+        self.name = None
+        self.token = None  # Used to resume our session after a reconnect
+        self.session_started = threading.Event()
+        self.subscriptions = {}  # Maps a subscription id to its callback
+        # Called with the queue position of a pending download
+        self.on_download_queued = None
 
         @self.sio.on("connect")
         def on_connect():
             pass
 
+        @self.sio.on("session")
+        def on_session(data):
+            if self.token is not None:
+                if data["resumed"]:
+                    print("[-] Reconnected to the server, session resumed")
+                else:
+                    print(
+                        "[!] Reconnected to the server, but the session had expired "
+                        "and your shared images were removed"
+                    )
+
+            self.name = data["name"]
+            self.token = data["token"]
+            # Sent along with every reconnect attempt
+            self.sio.connection_headers["resume"] = self.token
+            self.session_started.set()
+
+        @self.sio.on("new_image")
+        def on_new_image(data):
+            callback = self.subscriptions.get(data["subscription"])
+            if callback is not None:
+                callback(data["image"])
+
+        @self.sio.on("download_queued")
+        def on_download_queued(data):
+            if self.on_download_queued is not None:
+                self.on_download_queued(data["position"])
+
         @self.sio.on("disconnect")
         def on_disconnect():
-            print("[!] Disconnected from the server, exiting...")
-            os._exit(0)
+            if self.closing:
+                return
+            print("[!] Lost connection to the server, reconnecting...")
 
     def connect(self, name):
         try:
@@ -33,7 +75,14 @@ class SocketIOClient:
                 f"Failed to connect to the server at {self.server_url}"
             )
 
+        if not self.session_started.wait(timeout=5):
+            self.disconnect()
+            raise ConnectionError(
+                f"The server at {self.server_url} did not start a session"
+            )
+
     def disconnect(self):
+        self.closing = True
         self.sio.disconnect()
 
     def _is_not_image(self, path):
@@ -42,26 +91,48 @@ class SocketIOClient:
         """
         return imghdr.what(path) is None
 
-    def upload_image(self, path):
+    def upload_image(self, path, ttl=None):
         """
         Upload a single image file to the server.
+        If `ttl` is given, the server stops sharing the image after that many seconds.
         """
         if self._is_not_image(path):
             raise ValueError("The provided file is not an image!")
 
         with open(path, "rb") as f:
-            filedata = base64.b64encode(f.read())
+            self.upload_image_data(Path(path).name, f.read(), ttl)
 
-        data = {"filename": Path(path).name, "filedata": filedata}
-        self.sio.emit("upload_image", data=data)
+    def upload_image_data(self, filename, filedata, ttl=None):
+        """
+        Upload raw image bytes to the server under the given filename.
+        """
+        data = {"filename": filename, "filedata": base64.b64encode(filedata)}
+        if ttl is not None:
+            data["ttl"] = ttl
+        result = self.sio.call("upload_image", data=data, timeout=30)
+        if isinstance(result, dict) and "error" in result:
+            raise ValueError(result["error"])
 
-    def upload_folder(self, folder_path):
+    def delete_image(self, filename):
+        """
+        Stop sharing one of this user's images.
+        """
+        self.sio.emit("delete_image", filename)
+
+    def list_shared(self):
+        """
+        Get the names of the images the server currently holds for this user.
+        """
+        return self.sio.call("list_shared", timeout=5)
+
+    def upload_folder(self, folder_path, on_progress=None, ttl=None):
         """
         Upload all image files from a folder to the server.
+        If given, `on_progress` is called with the number of files uploaded so far after every upload,
+        and `ttl` is the number of seconds to share every image for.
         """
 
         count = 0  # Keep a track of the number of files uploaded
-        folder_name = Path(folder_path).name
 
         for root, _, files in os.walk(folder_path):
             for file in files:
@@ -69,34 +140,72 @@ class SocketIOClient:
                 if self._is_not_image(file_path):
                     # Don't upload non-image files
                     continue
-                relative_path = os.path.relpath(file_path, folder_path)
-                file_name = relative_path.replace(os.path.sep, "_")
                 with open(file_path, "rb") as file_content:
-                    self.sio.emit(
-                        "upload_image",
-                        {
-                            "filename": f"{folder_name}_{file_name}",
-                            "filedata": base64.b64encode(file_content.read()),
-                        },
+                    self.upload_image_data(
+                        remote_name(folder_path, file_path), file_content.read(), ttl
                     )
                     count += 1
+                if on_progress is not None:
+                    on_progress(count)
 
         return count
 
-    def search_for_images(self, query):
+    def search_for_images(self, query, **filters):
         """
         Search for images on the server based on a query.
+        Metadata filters such as `min_width`, `format` or `taken_after` narrow down the results.
+        """
+
+        filters = {k: v for k, v in filters.items() if v is not None}
+        data = {"query": query, **filters} if filters else query
+        result = self.sio.call("search", data, timeout=5)
+        if isinstance(result, dict):
+            raise ValueError(result["error"])
+        return result
+
+    def subscribe(self, query, callback, **filters):
+        """
+        Subscribe to new images matching a search query (and optional metadata filters).
+        The callback is called with the key of every new matching image. Returns the subscription id.
         """
 
-        result = self.sio.call("search", query, timeout=5)
+        filters = {k: v for k, v in filters.items() if v is not None}
+        data = {"query": query, **filters} if filters else query
+        result = self.sio.call("subscribe", data, timeout=5)
+        if isinstance(result, dict):
+            raise ValueError(result["error"])
+
+        self.subscriptions[result] = callback
         return result
 
-    def download_images(self, images, to_path):
+    def unsubscribe(self, sub_id):
+        """
+        Cancel a subscription.
+        """
+
+        self.subscriptions.pop(sub_id, None)
+        self.sio.emit("unsubscribe", sub_id)
+
+    def download_images(self, images, to_path, on_queued=None, **options):
         """
         Download selected images from the server and save them to a ZIP file.
+        The `max_dimension`, `format` and `quality` options make the server send
+        downscaled/transcoded previews instead of the original images.
+        If the server is busy, `on_queued` is called with the download's position in the queue.
         """
 
-        zipfile = self.sio.call("download_images", images, timeout=5)
+        options = {k: v for k, v in options.items() if v is not None}
+        data = {"images": images, **options} if options else images
+        self.on_download_queued = on_queued
+        try:
+            zipfile = self.sio.call("download_images", data, timeout=300)
+        finally:
+            self.on_download_queued = None
+        if isinstance(zipfile, dict):
+            return False, zipfile.get(
+                "error", "The server failed to prepare the download!"
+            )
+
         try:
             with open(to_path, "wb") as f:
                 f.write(zipfile)
@@ -106,3 +215,47 @@ class SocketIOClient:
                 False,
                 "Permission denied, you may have not provided a correct file path (ending in .zip)!",
             )
+        except OSError as e:
+            return False, f"Failed to write {to_path}: {e.strerror}"
+
+    def fetch_image(self, image, to_path):
+        """
+        Download a single image over HTTP, without zipping it.
+        If a previous fetch of the same image was interrupted, it is resumed
+        from where it stopped (as long as the image hasn't changed since).
+        """
+
+        owner, _, name = image.partition("__")
+        url = f"{self.server_url}/images/{quote(owner)}/{quote(name)}"
+        part_path = to_path + ".part"
+        etag_path = part_path + ".etag"
+
+        headers = {}
+        if os.path.exists(part_path) and os.path.exists(etag_path):
+            with open(etag_path, "r") as f:
+                headers["If-Range"] = f.read()
+            headers["Range"] = f"bytes={os.path.getsize(part_path)}-"
+
+        try:
+            with requests.get(url, headers=headers, stream=True, timeout=30) as res:
+                if res.status_code == 404:
+                    return False, "The image no longer exists!"
+                if res.status_code == 416:  # The partial download is already complete
+                    os.replace(part_path, to_path)
+                    os.remove(etag_path)
+                    return True, "Image downloaded successfully!"
+                res.raise_for_status()
+
+                with open(etag_path, "w") as f:
+                    f.write(res.headers.get("ETag", ""))
+                with open(part_path, "ab" if res.status_code == 206 else "wb") as f:
+                    for chunk in res.iter_content(chunk_size=64 * 1024):
+                        f.write(chunk)
+        except requests.RequestException as e:
+            return False, f"Failed to download the image: {e}"
+        except OSError as e:
+            return False, f"Failed to write {to_path}: {e.strerror}"
+
+        os.replace(part_path, to_path)
+        os.remove(etag_path)
+        return True, "Image downloaded successfully!"
@@ -0,0 +1,245 @@
+import os
+import sys
+import json
+import socket
+import argparse
+from client import SocketIOClient
+from socketio.exceptions import TimeoutError as sioTimeoutError
+from sync import FolderSyncer
+from typing import List
+
+# Exit codes
+EXIT_OK = 0
+EXIT_FAILURE = 1
+EXIT_USAGE = 2  # Used by argparse
+EXIT_CONNECTION_ERROR = 3
+
+
+def log(message: str) -> None:
+    """
+    Print a status message to stderr, keeping stdout free for results.
+    """
+    print(message, file=sys.stderr)
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(
+        prog="main.py",
+        description="Share, search and download images without any prompts. "
+        "Run without a command for the interactive menu.",
+    )
+    parser.add_argument(
+        "--server",
+        help="The server url (default: this machine's LAN address on port 8080)",
+    )
+    parser.add_argument(
+        "--name", default="Anonymous", help="The name to share images under"
+    )
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    upload = subparsers.add_parser(
+        "upload",
+        help="Share an image or folder of images until interrupted",
+    )
+    upload.add_argument("path", help="The image file or folder to share")
+    upload.add_argument(
+        "--ttl", type=float, help="Stop sharing the images after this many seconds"
+    )
+
+    sync = subparsers.add_parser(
+        "sync",
+        help="Incrementally sync a folder and keep it in sync until interrupted",
+    )
+    sync.add_argument("path", help="The folder to sync")
+
+    search = subparsers.add_parser("search", help="Search for shared images")
+    search.add_argument("query", help="The search query")
+    search.add_argument("--json", action="store_true", help="Print results as JSON")
+    search.add_argument("--format", help="Only show images of this format")
+    search.add_argument("--min-width", type=int, help="Minimum width in pixels")
+    search.add_argument("--min-height", type=int, help="Minimum height in pixels")
+    search.add_argument("--taken-after", help="Taken on or after this ISO date")
+    search.add_argument("--taken-before", help="Taken on or before this ISO date")
+
+    watch = subparsers.add_parser(
+        "watch", help="Print new images matching a query as they are shared"
+    )
+    watch.add_argument("query", help="The search query")
+    watch.add_argument("--json", action="store_true", help="Print images as JSON")
+    watch.add_argument("--format", help="Only show images of this format")
+    watch.add_argument("--min-width", type=int, help="Minimum width in pixels")
+    watch.add_argument("--min-height", type=int, help="Minimum height in pixels")
+
+    download = subparsers.add_parser(
+        "download", help="Download shared images to a ZIP file"
+    )
+    download.add_argument(
+        "keys", nargs="+", help="The images to download ('-' reads them from stdin)"
+    )
+    download.add_argument(
+        "-o", "--output", required=True, help="The output file path (ending in .zip)"
+    )
+    download.add_argument(
+        "--max-dimension", type=int, help="Download previews no larger than this"
+    )
+    download.add_argument("--format", help="Transcode to jpeg, png or webp")
+    download.add_argument("--quality", type=int, help="Encoding quality (1-95)")
+
+    fetch = subparsers.add_parser(
+        "fetch",
+        help="Download a single image over HTTP (resumes interrupted downloads)",
+    )
+    fetch.add_argument("key", help="The image to download")
+    fetch.add_argument("-o", "--output", required=True, help="The output file path")
+
+    return parser
+
+
+def upload(client: SocketIOClient, args: argparse.Namespace) -> int:
+    if os.path.isdir(args.path):
+        try:
+            n_files = client.upload_folder(args.path, ttl=args.ttl)
+        except ValueError as e:
+            log(str(e))
+            return EXIT_FAILURE
+        log(f"Shared {n_files} images from {args.path}")
+    else:
+        try:
+            client.upload_image(args.path, ttl=args.ttl)
+        except FileNotFoundError:
+            log(f"File not found: {args.path}")
+            return EXIT_FAILURE
+        except ValueError as e:
+            log(str(e))
+            return EXIT_FAILURE
+        log(f"Shared {args.path}")
+
+    log("Sharing until interrupted (Ctrl+C)...")
+    client.sio.wait()
+    return EXIT_OK
+
+
+def sync(client: SocketIOClient, args: argparse.Namespace) -> int:
+    if not os.path.isdir(args.path):
+        log(f"Not a folder: {args.path}")
+        return EXIT_FAILURE
+
+    syncer = FolderSyncer(client, args.path)
+    uploaded, deleted = syncer.sync()
+    log(f"Synced {args.path} ({uploaded} uploaded, {deleted} deleted)")
+    log("Watching for changes until interrupted (Ctrl+C)...")
+    syncer.watch(
+        lambda uploaded, deleted: log(
+            f"Synced changes ({uploaded} uploaded, {deleted} deleted)"
+        )
+    )
+    return EXIT_OK
+
+
+def search(client: SocketIOClient, args: argparse.Namespace) -> int:
+    try:
+        results = client.search_for_images(
+            args.query,
+            format=args.format,
+            min_width=args.min_width,
+            min_height=args.min_height,
+            taken_after=args.taken_after,
+            taken_before=args.taken_before,
+        )
+    except ValueError as e:
+        log(str(e))
+        return EXIT_FAILURE
+
+    if args.json:
+        print(json.dumps(results))
+    else:
+        for key in results:
+            print(key)
+    return EXIT_OK
+
+
+def watch(client: SocketIOClient, args: argparse.Namespace) -> int:
+    def on_new_image(key):
+        print(json.dumps({"image": key}) if args.json else key, flush=True)
+
+    try:
+        client.subscribe(
+            args.query,
+            on_new_image,
+            format=args.format,
+            min_width=args.min_width,
+            min_height=args.min_height,
+        )
+    except ValueError as e:
+        log(str(e))
+        return EXIT_FAILURE
+
+    log("Watching for new images until interrupted (Ctrl+C)...")
+    client.sio.wait()
+    return EXIT_OK
+
+
+def download(client: SocketIOClient, args: argparse.Namespace) -> int:
+    keys = args.keys
+    if keys == ["-"]:
+        keys = [line.strip() for line in sys.stdin if line.strip()]
+
+    ok, message = client.download_images(
+        keys,
+        os.path.abspath(args.output),
+        max_dimension=args.max_dimension,
+        format=args.format,
+        quality=args.quality,
+    )
+    log(message)
+    return EXIT_OK if ok else EXIT_FAILURE
+
+
+def fetch(client: SocketIOClient, args: argparse.Namespace) -> int:
+    ok, message = client.fetch_image(args.key, os.path.abspath(args.output))
+    log(message)
+    return EXIT_OK if ok else EXIT_FAILURE
+
+
+COMMANDS = {
+    "upload": upload,
+    "sync": sync,
+    "search": search,
+    "watch": watch,
+    "download": download,
+    "fetch": fetch,
+}
+
+
+def run(argv: List[str]) -> int:
+    """
+    Run a single non-interactive command.
+
+    Args:
+        argv (List): The command line arguments, excluding the program name.
+
+    Returns:
+        int: The process exit code.
+    """
+
+    args = build_parser().parse_args(argv)
+
+    server_url = (
+        args.server or f"http://{socket.gethostbyname(socket.gethostname())}:8080"
+    )
+    client = SocketIOClient(server_url)
+    try:
+        client.connect(args.name)
+    except ConnectionError as e:
+        log(str(e))
+        return EXIT_CONNECTION_ERROR
+
+    try:
+        return COMMANDS[args.command](client, args)
+    except sioTimeoutError:
+        log(f"The server at {server_url} did not respond in time")
+        return EXIT_CONNECTION_ERROR
+    except KeyboardInterrupt:
+        return EXIT_OK
+    finally:
+        client.disconnect()
@@ -1,11 +1,15 @@
 import os
+import sys
 import socket
 from cli_utils import CLIUtils
-from client import SocketIOClient
-from typing import Union
+from typing import TYPE_CHECKING, Union
 
+if TYPE_CHECKING:
+    # Importing the client pulls in socketio, which is slow, so it's only imported once we connect
+    from client import SocketIOClient
 
-def setup_client(name: str, cli: CLIUtils) -> Union[SocketIOClient, None]:
+
+def setup_client(name: str, cli: CLIUtils) -> Union["SocketIOClient", None]:
     """
     This function sets up the client by connecting to the server.
     Automatically determines the server URL assuming it's running on the LAN and on port 8080.
@@ -24,9 +28,10 @@ def setup_client(name: str, cli: CLIUtils) -> Union[SocketIOClient, None]:
 
     server_url = f"http://{socket.gethostbyname(socket.gethostname())}:8080"
 
-    client = SocketIOClient(server_url)
     with cli.spinner(text="Connecting to the server...", color="green") as spinner:
-        cli.wait(0.5)
+        from client import SocketIOClient
+
+        client = SocketIOClient(server_url)
         try:
             client.connect(name)
             spinner.text = "Connected to the server"
@@ -46,7 +51,6 @@ def setup_client(name: str, cli: CLIUtils) -> Union[SocketIOClient, None]:
 
     client.server_url = server_url
     with cli.spinner(text="Connecting to the server...", color="green") as spinner:
-        cli.wait(0.5)
         try:
             client.connect(name)
             spinner.text = "Connected to the server"
@@ -58,7 +62,7 @@ def setup_client(name: str, cli: CLIUtils) -> Union[SocketIOClient, None]:
             return None
 
 
-def upload_images(cli: CLIUtils, client: SocketIOClient) -> None:
+def upload_images(cli: CLIUtils, client: "SocketIOClient") -> None:
     """
     This function allows the user to upload either a single image file or an entire folder of image files to the server.
     If a folder is provided, all image files within the folder are uploaded.
@@ -75,17 +79,32 @@ def upload_images(cli: CLIUtils, client: SocketIOClient) -> None:
         "path",
         "Please enter the path to your image file or folder of image files",
     )
+    minutes = cli.get_text_input(
+        "ttl", "Share for how many minutes? (leave empty to share until you quit)"
+    ).strip()
+    try:
+        ttl = float(minutes) * 60 if minutes else None
+    except ValueError:
+        cli.log_error("The number of minutes must be a number!")
+        return
+
     if os.path.isdir(path):
-        with cli.spinner("Uploading folder...", color="green") as spinner:
-            n_files = client.upload_folder(path)
-            spinner.text = f"Folder uploaded! ({n_files}/{n_files} files)"
-            spinner.ok("[✓]")
+        try:
+            with cli.spinner("Uploading folder...", color="green") as spinner:
+
+                def on_progress(count):
+                    spinner.text = f"Uploading folder... ({count} files uploaded)"
+
+                n_files = client.upload_folder(path, on_progress, ttl)
+                spinner.text = f"Folder uploaded! ({n_files}/{n_files} files)"
+                spinner.ok("[✓]")
+        except ValueError as e:
+            cli.log_error(str(e))
 
     else:
         try:
             with cli.spinner("Uploading image...", color="green") as spinner:
-                cli.wait(0.3)
-                client.upload_image(path)
+                client.upload_image(path, ttl)
                 spinner.text = "Image uploaded!"
                 spinner.ok("[✓]")
         except FileNotFoundError:
@@ -94,7 +113,71 @@ def upload_images(cli: CLIUtils, client: SocketIOClient) -> None:
             cli.log_error(str(e))
 
 
-def download_images(name: str, cli: CLIUtils, client: SocketIOClient) -> None:
+def sync_folder(cli: CLIUtils, client: "SocketIOClient") -> None:
+    """
+    This function keeps a folder in sync with the server.
+    Only new or changed images are uploaded and deleted images are removed from the server.
+    The folder is then watched for changes until the user presses Ctrl+C.
+
+    Args:
+        cli (CLIUtils): An instance of CLIUtils for handling command-line interactions.
+        client (SocketIOClient): An instance of SocketIOClient for server communication.
+
+    Returns:
+        None
+    """
+
+    path = cli.get_path("path", "Please enter the path to the folder to sync")
+    if not os.path.isdir(path):
+        cli.log_error("The provided path is not a folder!")
+        return
+
+    from sync import FolderSyncer
+
+    syncer = FolderSyncer(client, path)
+    with cli.spinner("Syncing folder...", color="green") as spinner:
+        uploaded, deleted = syncer.sync()
+        spinner.text = f"Folder synced! ({uploaded} uploaded, {deleted} deleted)"
+        spinner.ok("[✓]")
+
+    cli.log_message("Watching the folder for changes, press Ctrl+C to stop")
+    try:
+        syncer.watch(
+            lambda uploaded, deleted: cli.log_message(
+                f"Synced changes ({uploaded} uploaded, {deleted} deleted)"
+            )
+        )
+    except KeyboardInterrupt:
+        cli.log_message("Stopped watching the folder")
+
+
+def subscribe(cli: CLIUtils, client: "SocketIOClient") -> None:
+    """
+    This function subscribes the user to a search query.
+    New images that match the query are announced as soon as they're shared.
+
+    Args:
+        cli (CLIUtils): An instance of CLIUtils for handling command-line interactions.
+        client (SocketIOClient): An instance of SocketIOClient for server communication.
+
+    Returns:
+        None
+    """
+
+    query = cli.get_text_input("query", "Enter the search query to subscribe to")
+    if not query:
+        cli.log_warning("No query provided, not subscribing.")
+        return
+
+    def on_new_image(img):
+        user, _, fname = img.partition("__")
+        cli.log_message(f"New image matching '{query}': {fname} (Uploader: {user})")
+
+    client.subscribe(query, on_new_image)
+    cli.log_message(f"Subscribed! You'll be notified of new images matching '{query}'")
+
+
+def download_images(name: str, cli: CLIUtils, client: "SocketIOClient") -> None:
     """
     This function allows the user to search for images on the server based on a query (defaulting to the user's name) and select images to download.
     Selected images are compressed into a ZIP file.
@@ -112,7 +195,6 @@ def download_images(name: str, cli: CLIUtils, client: SocketIOClient) -> None:
         cli.get_text_input("query", "Enter search query (default: your name)") or name
     )
     with cli.spinner(text="Searching for images..."):
-        cli.wait(0.3)
         images = client.search_for_images(query)
 
     if len(images) == 0:
@@ -137,9 +219,27 @@ def download_images(name: str, cli: CLIUtils, client: SocketIOClient) -> None:
         zip_path = cli.get_path(
             "path", "Please enter the output file path (ending in .zip)"
         )
+        max_dimension = cli.get_text_input(
+            "max_dimension",
+            "Maximum preview size in pixels (default: download the originals)",
+        )
+        if max_dimension and not max_dimension.isdigit():
+            cli.log_warning("Invalid preview size, downloading the originals")
+            max_dimension = None
+
         with cli.spinner("Downloading images...", color="green") as spinner:
-            cli.wait(0.3)
-            res = client.download_images(items, zip_path)
+
+            def on_queued(position):
+                spinner.text = (
+                    f"Waiting for the server... (position {position} in queue)"
+                )
+
+            res = client.download_images(
+                items,
+                zip_path,
+                on_queued=on_queued,
+                max_dimension=int(max_dimension) if max_dimension else None,
+            )
             if res[0]:
                 spinner.text = (
                     f"{len(items)}/{len(images)} Images downloaded to {zip_path}!"
@@ -165,20 +265,34 @@ def main():
         return
 
     while True:
-        cli.wait()
         choice = cli.get_multi_choice_input(
             "choice",
             "What would you like to do?",
-            ["Upload Images", "Download Images", "Quit"],
+            [
+                "Upload Images",
+                "Sync Folder",
+                "Download Images",
+                "Subscribe to a Search",
+                "Quit",
+            ],
         )
 
         if choice == "Upload Images":
             upload_images(cli, client)
+        elif choice == "Sync Folder":
+            sync_folder(cli, client)
         elif choice == "Download Images":
             download_images(name, cli, client)
+        elif choice == "Subscribe to a Search":
+            subscribe(cli, client)
         else:
             break
 
 
 if __name__ == "__main__":
+    if len(sys.argv) > 1:
+        import commands
+
+        sys.exit(commands.run(sys.argv[1:]))
+
     main()
@@ -0,0 +1,234 @@
+import os
+import json
+import time
+import hashlib
+import imghdr
+from pathlib import Path
+from typing import Callable, Dict, List, Tuple
+
+MANIFEST_DIR = os.path.join(Path.home(), ".imagedcpp", "manifests")
+
+
+def file_hash(path: str) -> str:
+    """
+    Compute the sha256 hash of the file at the given path.
+    """
+
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def remote_name(folder_path: str, file_path: str) -> str:
+    """
+    Get the name a file inside a shared folder is uploaded under.
+    Nested paths are flattened with underscores and prefixed with the folder's name.
+    """
+
+    relative_path = os.path.relpath(file_path, folder_path)
+    return f"{Path(folder_path).name}_{relative_path.replace(os.path.sep, '_')}"
+
+
+def snapshot(folder_path: str) -> Dict[str, Tuple[int, int]]:
+    """
+    Take a cheap snapshot of a folder, mapping every file path to its (size, mtime).
+    Only file metadata is read, never the file contents.
+    """
+
+    result = {}
+    for root, _, files in os.walk(folder_path):
+        for file in files:
+            file_path = os.path.join(root, file)
+            try:
+                st = os.stat(file_path)
+            except FileNotFoundError:
+                continue  # Deleted while walking
+            result[file_path] = (st.st_size, st.st_mtime_ns)
+    return result
+
+
+class Manifest:
+    """
+    Records the path, size, mtime and hash of every file synced from a folder,
+    so that later syncs only upload new or changed files.
+    Non-image files are recorded by size and mtime only, so they aren't read again until they change.
+
+    Args:
+        folder_path (str): The folder this manifest belongs to.
+
+    Attributes:
+        folder_path (str): The absolute path of the synced folder.
+        path (str): Where the manifest is stored on disk.
+        entries (Dict): Maps a file path to a dict with its size, mtime, hash and remote name,
+            or with its size, mtime and `"image": False` for non-image files.
+    """
+
+    def __init__(self, folder_path: str) -> None:
+        self.folder_path = os.path.abspath(folder_path)
+        key = hashlib.sha1(self.folder_path.encode()).hexdigest()
+        self.path = os.path.join(MANIFEST_DIR, f"{key}.json")
+        self.entries: Dict[str, Dict] = {}
+
+        try:
+            with open(self.path, "r") as f:
+                self.entries = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            pass
+
+    def save(self) -> None:
+        os.makedirs(MANIFEST_DIR, exist_ok=True)
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(self.entries, f)
+        os.replace(tmp_path, self.path)
+
+    def diff(
+        self, current: Dict[str, Tuple[int, int]], on_server: List[str]
+    ) -> Tuple[List[str], List[str]]:
+        """
+        Compare a folder snapshot against the manifest.
+
+        Files whose size and mtime are unchanged are skipped without being read.
+        Files whose size or mtime changed are re-hashed, so touching a file doesn't re-upload it.
+        Files the server no longer has (eg. after a server restart) are always uploaded again.
+        Non-image files are only checked again once their size or mtime changes.
+
+        Args:
+            current (Dict): A snapshot of the folder as returned by `snapshot`.
+            on_server (List): The names of the files the server currently holds for this user.
+
+        Returns:
+            Tuple: A list of file paths to upload and a list of file paths that were deleted.
+        """
+
+        on_server = set(on_server)
+        changed = []
+
+        for file_path, (size, mtime) in current.items():
+            entry = self.entries.get(file_path)
+            if entry is not None and not entry.get("image", True):
+                if (entry["size"], entry["mtime"]) != (size, mtime):
+                    changed.append(file_path)  # It may be an image now
+            elif entry is None or entry["name"] not in on_server:
+                changed.append(file_path)
+            elif (entry["size"], entry["mtime"]) != (size, mtime):
+                try:
+                    digest = file_hash(file_path)
+                except FileNotFoundError:
+                    continue
+                if digest != entry["hash"]:
+                    changed.append(file_path)
+                else:
+                    entry["size"], entry["mtime"] = size, mtime
+
+        deleted = [file_path for file_path in self.entries if file_path not in current]
+        return changed, deleted
+
+
+class FolderSyncer:
+    """
+    Keeps a folder in sync with the server by uploading new or changed images
+    and telling the server about deleted ones.
+
+    Args:
+        client: The SocketIOClient used to talk to the server.
+        folder_path (str): The folder to sync.
+    """
+
+    def __init__(self, client, folder_path: str) -> None:
+        self.client = client
+        self.folder_path = os.path.abspath(folder_path)
+        self.manifest = Manifest(self.folder_path)
+
+    def sync(self, current: Dict[str, Tuple[int, int]] = None) -> Tuple[int, int]:
+        """
+        Run a single incremental sync.
+
+        Args:
+            current (Dict): An optional, already taken snapshot of the folder.
+
+        Returns:
+            Tuple: The number of images uploaded and the number of images deleted.
+        """
+
+        if current is None:
+            current = snapshot(self.folder_path)
+
+        changed, deleted = self.manifest.diff(current, self.client.list_shared())
+
+        uploaded = 0
+        deleted_images = 0
+        for file_path in changed:
+            name = remote_name(self.folder_path, file_path)
+            size, mtime = current[file_path]
+            try:
+                if imghdr.what(file_path) is None:
+                    # Don't upload non-image files, but remember them so they aren't checked again
+                    entry = self.manifest.entries.get(file_path)
+                    if entry is not None and entry.get("image", True):
+                        self.client.delete_image(entry["name"])
+                        deleted_images += 1
+                    self.manifest.entries[file_path] = {
+                        "size": size,
+                        "mtime": mtime,
+                        "image": False,
+                    }
+                    continue
+                with open(file_path, "rb") as f:
+                    filedata = f.read()
+            except FileNotFoundError:
+                continue
+
+            self.client.upload_image_data(name, filedata)
+            self.manifest.entries[file_path] = {
+                "name": name,
+                "size": size,
+                "mtime": mtime,
+                "hash": hashlib.sha256(filedata).hexdigest(),
+            }
+            uploaded += 1
+
+        for file_path in deleted:
+            entry = self.manifest.entries.pop(file_path)
+            if entry.get("image", True):
+                self.client.delete_image(entry["name"])
+                deleted_images += 1
+
+        self.manifest.save()
+        return uploaded, deleted_images
+
+    def watch(
+        self,
+        on_sync: Callable[[int, int], None],
+        interval: float = 1.0,
+        debounce: float = 2.0,
+    ) -> None:
+        """
+        Poll the folder for changes and sync them incrementally, forever.
+
+        A sync only runs once the folder has been quiet for `debounce` seconds,
+        so copying many files in at once results in a single sync.
+
+        Args:
+            on_sync (Callable): Called with (uploaded, deleted) after every sync that changed something.
+            interval (float): How often to poll the folder, in seconds.
+            debounce (float): How long the folder must be unchanged before syncing, in seconds.
+        """
+
+        last = snapshot(self.folder_path)
+        changed_at = None
+
+        while True:
+            time.sleep(interval)
+            current = snapshot(self.folder_path)
+
+            if current != last:
+                last = current
+                changed_at = time.monotonic()
+            elif changed_at is not None and time.monotonic() - changed_at >= debounce:
+                changed_at = None
+                uploaded, deleted = self.sync(current)
+                if uploaded or deleted:
+                    on_sync(uploaded, deleted)
@@ -0,0 +1,90 @@
+import time
+import asyncio
+from typing import Any, Callable, Dict, List, Tuple
+
+
+class TimerWheel:
+    """
+    A hashed timer wheel for expiring keys.
+
+    Time is split into ticks of `resolution` seconds and the wheel has one slot per tick.
+    A timer is put into the slot it expires in, along with the number of full turns of the wheel
+    left until then. Every tick only looks at the timers in the current slot, so scheduling,
+    cancelling and expiring a timer are all O(1) amortised, and nothing ever scans every key.
+
+    Args:
+        on_expire (Callable): Called with the key and value of every timer that expires.
+        resolution (float): The length of a tick in seconds.
+        slots (int): The number of slots, the wheel turns once every `resolution * slots` seconds.
+    """
+
+    def __init__(
+        self,
+        on_expire: Callable[[str, Any], None],
+        resolution: float = 1.0,
+        slots: int = 3600,
+    ) -> None:
+        self.on_expire = on_expire
+        self.resolution = resolution
+        self._slots: List[Dict[str, Tuple[int, Any]]] = [{} for _ in range(slots)]
+        self._slot_of: Dict[str, int] = {}
+        self._tick = 0  # The number of ticks processed so far
+        self._started = time.monotonic()
+
+    def __len__(self) -> int:
+        return len(self._slot_of)
+
+    def __contains__(self, key: str) -> bool:
+        return key in self._slot_of
+
+    def schedule(self, key: str, delay: float, value: Any = None) -> None:
+        """
+        Expire a key after `delay` seconds, replacing its previous timer if it had one.
+        """
+
+        self.cancel(key)
+
+        ticks = max(1, round(delay / self.resolution))
+        target = self._tick + ticks
+        slot = target % len(self._slots)
+        # The current slot is only looked at again on the next turn of the wheel
+        rounds = (ticks - 1) // len(self._slots)
+
+        self._slots[slot][key] = (rounds, value)
+        self._slot_of[key] = slot
+
+    def cancel(self, key: str) -> None:
+        slot = self._slot_of.pop(key, None)
+        if slot is not None:
+            del self._slots[slot][key]
+
+    def advance(self) -> None:
+        """
+        Process every tick that has elapsed since the last call.
+        """
+
+        now_tick = int((time.monotonic() - self._started) / self.resolution)
+        while self._tick < now_tick:
+            self._tick += 1
+            slot = self._slots[self._tick % len(self._slots)]
+
+            expired = []
+            for key, (rounds, value) in slot.items():
+                if rounds == 0:
+                    expired.append((key, value))
+                else:
+                    slot[key] = (rounds - 1, value)
+
+            for key, value in expired:
+                del slot[key]
+                del self._slot_of[key]
+                self.on_expire(key, value)
+
+    async def run(self) -> None:
+        """
+        Advance the wheel once every tick, forever.
+        """
+
+        while True:
+            await asyncio.sleep(self.resolution)
+            self.advance()
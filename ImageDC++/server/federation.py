@@ -0,0 +1,160 @@
+import json
+import time
+import asyncio
+import aiohttp
+from collections import OrderedDict
+from urllib.parse import quote, urlsplit
+from typing import Dict, List, Optional, Tuple
+
+
+def remote_key(owner: str, peer: str, fn: str) -> str:
+    """
+    Get the key an image shared on a peer server is listed under, eg. `alice@lab2:8080__cat.png`.
+    """
+
+    return f"{owner}@{peer}__{fn}"
+
+
+def split_remote_key(key: str) -> Optional[Tuple[str, str, str]]:
+    """
+    Split a remote image key into its owner, peer and filename.
+
+    Returns:
+        Tuple: The owner, peer and filename, or None if the key is not a remote key.
+    """
+
+    owner, _, fn = key.partition("__")
+    if "@" not in owner:
+        return None
+    owner, _, peer = owner.rpartition("@")
+    return owner, peer, fn
+
+
+class Federation:
+    """
+    Searches and fetches images on peer ImageDC++ servers.
+
+    Searches are sent to every peer at once and whatever comes back before the deadline
+    is used, so a slow or offline peer only costs the deadline and never fails a search.
+    Each peer's results are cached for `cache_ttl` seconds, so many users running the
+    same search don't multiply the load on peers.
+
+    Peers are named by the host and port of their URL.
+
+    Args:
+        peers (List): The base URLs of the peer servers, eg. `http://lab2:8080`.
+        deadline (float): The number of seconds to wait for peers to answer a search.
+        cache_ttl (float): The number of seconds peer results are cached for.
+        cache_size (int): The maximum number of cached results.
+    """
+
+    def __init__(
+        self,
+        peers: List[str],
+        deadline: float = 1.0,
+        cache_ttl: float = 10.0,
+        cache_size: int = 256,
+    ) -> None:
+        self.peers: Dict[str, str] = {
+            urlsplit(url).netloc: url.rstrip("/") for url in peers
+        }
+        self.deadline = deadline
+        self.cache_ttl = cache_ttl
+        self.cache_size = cache_size
+
+        self._cache: OrderedDict = OrderedDict()  # (peer, query) -> (expires, results)
+        self._session: Optional[aiohttp.ClientSession] = None
+
+    def __bool__(self) -> bool:
+        return bool(self.peers)
+
+    async def start(self) -> None:
+        self._session = aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=60))
+
+    async def close(self) -> None:
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    async def search(self, query) -> List[Tuple[str, int]]:
+        """
+        Search every peer for images, taking the same query as the `search` event.
+
+        Returns:
+            List: The remote keys of the matching images with their scores.
+        """
+
+        if not self.peers:
+            return []
+
+        cache_key = json.dumps(query, sort_keys=True)
+        tasks = {
+            asyncio.ensure_future(self._search_peer(peer, query, cache_key)): peer
+            for peer in self.peers
+        }
+        done, pending = await asyncio.wait(tasks, timeout=self.deadline)
+        for task in pending:
+            task.cancel()  # Too slow, answer without it
+
+        results = []
+        for task in done:
+            if task.exception() is not None:
+                continue  # Offline or not an ImageDC++ server
+            results.extend(task.result())
+        return results
+
+    async def _search_peer(
+        self, peer: str, query, cache_key: str
+    ) -> List[Tuple[str, int]]:
+        cached = self._cache.get((peer, cache_key))
+        if cached is not None and cached[0] > time.monotonic():
+            return cached[1]
+
+        async with self._session.post(
+            f"{self.peers[peer]}/peer/search", json=query
+        ) as resp:
+            resp.raise_for_status()
+            matches = await resp.json()
+
+        results = []
+        for key, score in matches:
+            owner, _, fn = key.partition("__")
+            results.append((remote_key(owner, peer, fn), score))
+
+        self._cache[(peer, cache_key)] = (time.monotonic() + self.cache_ttl, results)
+        self._cache.move_to_end((peer, cache_key))
+        while len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+
+        return results
+
+    def image_url(self, key: str) -> Optional[str]:
+        """
+        Get the URL an image is served at by its peer, or None if the key isn't from a known peer.
+        """
+
+        parts = split_remote_key(key)
+        if parts is None or parts[1] not in self.peers:
+            return None
+        owner, peer, fn = parts
+        return f"{self.peers[peer]}/images/{quote(owner)}/{quote(fn)}"
+
+    async def fetch(self, key: str) -> Optional[bytes]:
+        """
+        Download an image from its peer.
+
+        Returns:
+            bytes: The image, or None if the peer doesn't have it (anymore).
+        """
+
+        url = self.image_url(key)
+        if url is None:
+            return None
+
+        try:
+            async with self._session.get(url) as resp:
+                if resp.status != 200:
+                    return None
+                return await resp.read()
+        except (aiohttp.ClientError, asyncio.TimeoutError):
+            return None
@@ -0,0 +1,140 @@
+import os
+import traceback
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from typing import Dict, List, Optional, Tuple
+from metadata import extract_file_metadata
+
+LIBRARY_OWNER = "library"  # The name library images are shared under
+
+
+def library_key(root: str, path: str) -> str:
+    """
+    Get the key a library file is shared under.
+    Nested paths are flattened with underscores, same as folders uploaded by clients.
+    """
+
+    relative_path = os.path.relpath(path, root)
+    return f"{LIBRARY_OWNER}__{relative_path.replace(os.path.sep, '_')}"
+
+
+def _scan_dir(path: str) -> Tuple[Dict[str, Tuple[int, int]], List[str]]:
+    """
+    List a single directory.
+
+    Returns:
+        Tuple: The (size, mtime) of every file in it by path, and the paths of its subdirectories.
+    """
+
+    files, subdirs = {}, []
+    try:
+        with os.scandir(path) as entries:
+            for entry in entries:
+                if entry.name.startswith("."):
+                    continue  # Hidden files, editors' swap files, etc.
+                if entry.is_dir(follow_symlinks=False):
+                    subdirs.append(entry.path)
+                elif entry.is_file():
+                    st = entry.stat()
+                    files[entry.path] = (st.st_size, st.st_mtime_ns)
+    except OSError:
+        pass  # Deleted or unreadable while scanning, picked up by the next scan
+    return files, subdirs
+
+
+def _read_metadata(path: str) -> Optional[Dict]:
+    try:
+        return extract_file_metadata(path)
+    except OSError:
+        return None  # Deleted or unreadable since it was listed
+    except Exception:
+        # One bad file mustn't stop the scan, it is tried again on the next one
+        traceback.print_exc()
+        return None
+
+
+class Library:
+    """
+    A directory of images the server shares by itself, without a client uploading them.
+
+    The directory tree is walked by a pool of threads, one directory per task, so large
+    trees on slow disks or network shares are listed in parallel. Every scan after the
+    first only opens the files whose size or modification time changed since the last one.
+
+    Args:
+        root (str): The library directory.
+        workers (int): The number of threads used to walk the directory and read metadata.
+    """
+
+    def __init__(self, root: str, workers: int = 8) -> None:
+        self.root = os.path.abspath(root)
+        self.workers = workers
+        self._files: Dict[str, Tuple[int, int]] = {}  # Images from the last scan
+        self._skipped: Dict[str, Tuple[int, int]] = {}  # Non-images from the last scan
+
+    def __len__(self) -> int:
+        return len(self._files)
+
+    def walk(self, pool: ThreadPoolExecutor) -> Dict[str, Tuple[int, int]]:
+        """
+        List every file in the library.
+
+        Returns:
+            Dict: The (size, mtime) of every file, by path.
+        """
+
+        files = {}
+        pending = {pool.submit(_scan_dir, self.root)}
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                dir_files, subdirs = future.result()
+                files.update(dir_files)
+                pending.update(pool.submit(_scan_dir, subdir) for subdir in subdirs)
+        return files
+
+    def scan(self) -> Tuple[Dict[str, Tuple[str, Dict]], List[str]]:
+        """
+        Find the images that were added, changed or removed since the last scan.
+        This blocks, so it should be run in an executor.
+
+        Returns:
+            Tuple: The path and metadata of every new or changed image by key,
+                and the keys of the removed images.
+        """
+
+        with ThreadPoolExecutor(self.workers) as pool:
+            files = self.walk(pool)
+
+            changed = [
+                path
+                for path, stat in files.items()
+                if self._files.get(path) != stat and self._skipped.get(path) != stat
+            ]
+            removed = [
+                library_key(self.root, path)
+                for path in self._files
+                if path not in files
+            ]
+
+            updated = {}
+            for path, meta in zip(changed, pool.map(_read_metadata, changed)):
+                if meta is None:
+                    continue
+                if meta["format"] is None:
+                    # Not an image, don't open it again until it changes
+                    self._skipped[path] = files[path]
+                    if self._files.pop(path, None) is not None:
+                        removed.append(library_key(self.root, path))
+                    continue
+                self._files[path] = files[path]
+                self._skipped.pop(path, None)
+                updated[library_key(self.root, path)] = (path, meta)
+
+        for path in list(self._files):
+            if path not in files:
+                del self._files[path]
+        for path in list(self._skipped):
+            if path not in files:
+                del self._skipped[path]
+
+        return updated, removed
@@ -1,61 +1,262 @@
+import json
+import math
 import socketio
 import base64
+import asyncio
+import traceback
+import mimetypes
 from aiohttp import web
+from typing import List, Optional, Tuple
 from fuzzywuzzy import process
 from utils import User, zip_images, ensure_non_clashing_name, clean_name
+from variants import VariantStore, parse_variant_options, variant_filename
+from metadata import MetadataIndex, extract_metadata, parse_filters
+from subscriptions import SubscriptionIndex
+from scheduler import DownloadScheduler, DownloadCancelled
+from store import ImageStore, StoredImage
+from expiry import TimerWheel
+from federation import Federation
+from library import Library, LIBRARY_OWNER
 
 sio = socketio.AsyncServer(max_http_buffer_size=50_000_000)  # 50 MB upload limit
 app = web.Application()
 sio.attach(app)
 
-users: [str, User] = {}
-images: [str, str] = {}
+users: [str, User] = {}  # Connected users, by sid
+sessions: [str, User] = {}  # Every user including recently disconnected ones, by token
+grace_period = 60  # Seconds a disconnected user's images are kept for
+max_ttl = 365 * 24 * 60 * 60  # Longer ttls are clamped to a year
+store = ImageStore()
+variants = VariantStore(max_bytes=256_000_000)  # 256 MB of cached previews
+metadata = MetadataIndex()
+subscriptions = SubscriptionIndex()
+scheduler = DownloadScheduler(concurrency=4)  # Downloads prepared at once
+federation = Federation(peers=[])  # Other ImageDC++ servers to search
+library: Optional[Library] = None  # A directory of images shared by the server itself
+library_rescan = 10  # Seconds between scans of the library for changes
+
+
+def remove_image(key: str) -> None:
+    """
+    Remove an image from the server along with everything derived from it.
+    """
+
+    store.remove(key)
+    variants.discard(key)
+    metadata.remove(key)
+    expiry.cancel(key)
+
+
+def expire_image(key: str, user: User) -> None:
+    """
+    Remove an image whose time-to-live is over.
+    """
+
+    print("Image Expired: ", key)
+    remove_image(key)
+    user.shared.pop(key.partition("__")[2], None)
+
+    # Forget users whose session already ended once their last image expires
+    if not user.shared and user.sid not in users and user.expiry is None:
+        sessions.pop(user.token, None)
+
+
+expiry = TimerWheel(expire_image)
 
 
 @sio.event
-def connect(sid, environ):
+async def connect(sid, environ):
     """
     This event creates a new user and adds them to the users dictionary.
+    If the client sends the token of a session that is still in its grace period,
+    that session is resumed instead, along with all of its images.
+    The client is sent its session token and name.
     """
 
-    name = environ.get("HTTP_NAME")
-    names = [user.name for user in users.values()]
+    user = sessions.get(environ.get("HTTP_RESUME"))
+    resumed = user is not None and user.expiry is not None
+
+    if resumed:
+        user.expiry.cancel()
+        user.expiry = None
+        subscriptions.move_sid(user.sid, sid)
+        user.sid = sid
+        print("Resume: ", user)
+    else:
+        name = environ.get("HTTP_NAME")
+        names = [user.name for user in sessions.values()]
+        if library is not None:
+            names.append(LIBRARY_OWNER)
 
-    name = clean_name(ensure_non_clashing_name(name, names))
+        name = clean_name(ensure_non_clashing_name(name, names))
+
+        user = User(sid, name)
+        sessions[user.token] = user
+        print("Connect: ", user)
 
-    user = User(sid, name)
     users[sid] = user
-    print("Connect: ", user)
+    await sio.emit(
+        "session",
+        {"token": user.token, "name": user.name, "resumed": resumed},
+        to=sid,
+    )
 
 
 @sio.event
 async def upload_image(sid, data):
     """
     This event stores the uploaded image in the user's shared images.
+    If `ttl` (in seconds) is set, the image is removed once it is over, even if the user is
+    still connected, and it outlives the user's connection until then.
     """
 
+    ttl = data.get("ttl")
+    if ttl is not None:
+        # Clients may send true, Infinity or NaN, none of which can be scheduled
+        if (
+            isinstance(ttl, bool)
+            or not isinstance(ttl, (int, float))
+            or (isinstance(ttl, float) and not math.isfinite(ttl))
+            or ttl <= 0
+        ):
+            return {"error": "ttl must be a positive number of seconds"}
+        ttl = min(ttl, max_ttl)
+
     user = users[sid]
     fn = data["filename"]
-    images[f"{user.name}__{fn}"] = data["filedata"]
-    user.shared.append(fn)
+    key = f"{user.name}__{fn}"
+    filedata = base64.b64decode(data["filedata"])
+    store.put_bytes(key, filedata)
+    variants.discard(key)
+    metadata.add(key, extract_metadata(filedata))
+    user.shared[fn] = None
+    if ttl is not None:
+        expiry.schedule(key, ttl, user)
+    else:
+        expiry.cancel(key)
     print("Image Upload: ", user, fn)
 
+    await notify_subscribers(key)
+
+
+async def notify_subscribers(key: str) -> None:
+    """
+    Push a new image to every user with a matching subscription.
+    """
+
+    for sub, score in subscriptions.match(key):
+        subscriber = users.get(sub.sid)
+        # Don't notify users about their own images
+        if subscriber is None or key.partition("__")[0] == subscriber.name:
+            continue
+        if sub.filters and not metadata.matches(key, sub.filters):
+            continue
+
+        print("Notify: ", subscriber, sub, key)
+        await sio.emit("new_image", {"subscription": sub.id, "image": key}, to=sub.sid)
+
+
+@sio.event
+async def subscribe(sid, query):
+    """
+    This event subscribes the user to new images that match a search query.
+    The query takes the same form as for `search`. Returns the subscription's id.
+    """
+
+    filters = {}
+    if isinstance(query, dict):
+        try:
+            filters = parse_filters(query)
+        except ValueError as e:
+            return {"error": str(e)}
+        query = query.get("query") or ""
+
+    sub = subscriptions.add(sid, query, filters)
+    print("Subscribe: ", users[sid], sub)
+    return sub.id
+
+
+@sio.event
+async def unsubscribe(sid, sub_id):
+    """
+    This event cancels one of the user's subscriptions.
+    """
+
+    if subscriptions.owned_by(sid, sub_id):
+        subscriptions.remove(sub_id)
+
+
+@sio.event
+async def delete_image(sid, fn):
+    """
+    This event stops sharing one of the user's images.
+    """
+
+    user = users[sid]
+    remove_image(f"{user.name}__{fn}")
+    user.shared.pop(fn, None)
+    print("Image Delete: ", user, fn)
+
+
+@sio.event
+async def list_shared(sid):
+    """
+    This event returns the names of the images the user is currently sharing.
+    """
+
+    return list(users[sid].shared)
+
+
+def match_images(query) -> List[Tuple[str, int]]:
+    """
+    Fuzzy search the images shared on this server.
+    The query is either a string, or a dict with the string under `query` and optional
+    metadata filters (eg. `min_width`, `format`, `taken_after`).
+    Filters are evaluated on the metadata index, never on the image bytes.
+
+    Returns:
+        List: The best matching image keys with their scores.
+
+    Raises:
+        ValueError: If a filter is invalid.
+    """
+
+    filters = {}
+    if isinstance(query, dict):
+        filters = parse_filters(query)
+        query = query.get("query") or ""
+
+    candidates = metadata.filter(filters) if filters else store.keys()
+    if query:
+        return process.extract(query, candidates)
+    return [(img, 100) for img in candidates]  # Only filter
+
 
 @sio.event
 async def search(sid, query):
     """
-    This event searches for images that match the query using fuzzy search.
+    This event searches for images that match the query using fuzzy search,
+    on this server and on its peers. The query takes the same form as for `match_images`.
     """
 
     print("Search: ", query)
 
+    try:
+        matches = match_images(query)
+    except ValueError as e:
+        return {"error": str(e)}
+
+    if federation:
+        matches += await federation.search(query)
+        matches.sort(key=lambda match: match[1], reverse=True)
+
     search_results = []
     user = users[sid]
 
     # Fuzzy search
-    for matched_img in process.extract(query, images.keys()):
+    for matched_img in matches:
         # Don't show the user's own images
-        if matched_img[0].startswith(user.name):
+        if matched_img[0].partition("__")[0] == user.name:
             continue
 
         print(matched_img)
@@ -71,35 +272,261 @@ async def search(sid, query):
     return search_results
 
 
+async def peer_search_handler(request: web.Request) -> web.Response:
+    """
+    Answer a search from a peer server, at `/peer/search`.
+    Only images shared on this server are searched, so searches never bounce between peers.
+    """
+
+    try:
+        query = await request.json()
+    except (json.JSONDecodeError, UnicodeDecodeError):
+        raise web.HTTPBadRequest(text="The search must be JSON")
+    if not isinstance(query, (str, dict)):
+        raise web.HTTPBadRequest(text="The search must be a string or an object")
+
+    print("Peer Search: ", request.remote, query)
+    try:
+        return web.json_response(match_images(query))
+    except ValueError as e:
+        raise web.HTTPBadRequest(text=str(e))
+
+
 @sio.event
 async def download_images(sid, data):
     """
     This event zips and sends the requested images to the client.
+    The request is either a list of image names, or a dict with the image names under `images`
+    and optional `max_dimension`, `format` and `quality` options to downscale/transcode them.
+    Downloads are queued by the scheduler, the client is sent its queue position while it waits.
     """
 
+    if isinstance(data, dict):
+        try:
+            options = parse_variant_options(data)
+        except ValueError as e:
+            return {"error": str(e)}
+        data = data.get("images", [])
+    else:
+        options = (None, None, None)
+
+    async def on_position(position):
+        await sio.emit("download_queued", {"position": position}, to=sid)
+
+    try:
+        return await scheduler.run(
+            sid, len(data), lambda: prepare_download(data, options), on_position
+        )
+    except DownloadCancelled:
+        return {"error": "Download cancelled"}
+
+
+async def prepare_download(data, options) -> bytes:
+    """
+    Zip the requested images, downscaling/transcoding them first if any options are set.
+    """
+
+    loop = asyncio.get_running_loop()
+
     result = {}
+    remote = []
     for fn in data:
+        image = store.get(fn)
+        if image is None:
+            if federation.image_url(fn) is not None:
+                remote.append(fn)
+            continue  # Ignore images that don't exist (uploader disconnected)
+        if image.data is not None:
+            result[fn] = image.data
+        else:
+            result[fn] = await loop.run_in_executor(None, image.read)
+
+    # Images shared on peers are proxied through this server
+    fetched = await asyncio.gather(*(federation.fetch(fn) for fn in remote))
+    for fn, filedata in zip(remote, fetched):
+        if filedata is not None:
+            result[fn] = filedata
+
+    if options != (None, None, None):
+        transformed = await asyncio.gather(
+            *(variants.get(fn, result[fn], options) for fn in result),
+            return_exceptions=True,
+        )
+        for fn, variant in zip(list(result), transformed):
+            if isinstance(variant, Exception):
+                continue  # Not decodable by Pillow, send the original
+            del result[fn]
+            result[variant_filename(fn, options)] = variant
+
+    return await loop.run_in_executor(None, zip_images, result)
+
+
+async def image_handler(request: web.Request) -> web.StreamResponse:
+    """
+    Serve a single image over plain HTTP, at `/images/{owner}/{name}`.
+    Supports `Range` requests so interrupted downloads can resume, and strong ETags
+    (`If-None-Match` / `If-Range`) so clients can revalidate cheaply.
+    Images on disk are streamed with sendfile, and images shared on peers are redirected to them.
+    """
+
+    key = f"{request.match_info['owner']}__{request.match_info['name']}"
+    image = store.get(key)
+    if image is None:
+        peer_url = federation.image_url(key)
+        if peer_url is not None:
+            raise web.HTTPTemporaryRedirect(peer_url)
+        raise web.HTTPNotFound(text="Image not found")
+
+    if image.path is not None:
+        # FileResponse handles Range, If-Range and If-None-Match itself, using the same ETag
+        return web.FileResponse(image.path)
+
+    return serve_bytes(request, image)
+
+
+def serve_bytes(request: web.Request, image: StoredImage) -> web.Response:
+    """
+    Serve an in-memory image, honouring conditional and Range requests.
+    """
+
+    headers = {
+        "ETag": image.etag,
+        "Accept-Ranges": "bytes",
+        "Content-Type": mimetypes.guess_type(image.key)[0]
+        or "application/octet-stream",
+    }
+
+    if_none_match = request.headers.get("If-None-Match")
+    if if_none_match and image.etag in (t.strip() for t in if_none_match.split(",")):
+        return web.Response(status=304, headers=headers)
+
+    if (
+        "Range" not in request.headers
+        or request.headers.get("If-Range", image.etag) != image.etag
+    ):
+        return web.Response(body=image.data, headers=headers)
+
+    try:
+        rng = request.http_range
+    except ValueError:
+        rng = None  # Ignore malformed ranges and send the whole image
+
+    if rng is None:
+        return web.Response(body=image.data, headers=headers)
+
+    start, stop, _ = rng.indices(image.size)
+    if start >= image.size or start >= stop:
+        headers["Content-Range"] = f"bytes */{image.size}"
+        return web.Response(status=416, headers=headers)
+
+    headers["Content-Range"] = f"bytes {start}-{stop - 1}/{image.size}"
+    return web.Response(
+        status=206, body=memoryview(image.data)[start:stop], headers=headers
+    )
+
+
+app.router.add_get("/images/{owner}/{name}", image_handler)
+app.router.add_post("/peer/search", peer_search_handler)
+
+
+async def scan_library() -> None:
+    """
+    Share the library's new and changed images and stop sharing its removed ones.
+    """
+
+    updated, removed = await asyncio.get_running_loop().run_in_executor(
+        None, library.scan
+    )
+
+    for key in removed:
+        remove_image(key)
+
+    indexed = {}
+    for key, (path, meta) in updated.items():
+        try:
+            store.put_file(key, path)
+        except OSError:
+            continue  # Removed since it was scanned
+        except Exception:
+            traceback.print_exc()  # Skip the file, keep sharing the rest
+            continue
+        variants.discard(key)
+        indexed[key] = meta
+    metadata.add_many(indexed)
+
+    if updated or removed:
+        print(f"Library Scan: {len(indexed)} updated, {len(removed)} removed")
+    for key in indexed:
+        await notify_subscribers(key)
+
+
+async def watch_library() -> None:
+    while True:
+        await asyncio.sleep(library_rescan)
         try:
-            result[fn] = base64.b64decode(images[fn])
-        except KeyError:
-            pass  # Ignore images that don't exist (uploader disconnected)
+            await scan_library()
+        except Exception:
+            traceback.print_exc()  # Try again on the next rescan
 
-    return zip_images(result)
+
+async def start_background_tasks(app: web.Application) -> None:
+    app["expiry"] = asyncio.create_task(expiry.run())
+    await federation.start()
+
+    if library is not None:
+        await scan_library()  # Everything is shared before the first user connects
+        if library_rescan > 0:
+            app["library"] = asyncio.create_task(watch_library())
+
+
+async def stop_background_tasks(app: web.Application) -> None:
+    app["expiry"].cancel()
+    if "library" in app:
+        app["library"].cancel()
+    await federation.close()
+
+
+app.on_startup.append(start_background_tasks)
+app.on_cleanup.append(stop_background_tasks)
 
 
 @sio.event
 def disconnect(sid):
     """
-    This event deletes the user's uploaded images when they disconnect.
+    This event keeps the user's session for the grace period, so they can reconnect
+    and resume it, and deletes their uploaded images once it's over.
     """
 
     print("Disconnect: ", sid)
-    user = users[sid]
-    for img in list(images.keys()):
-        if img.startswith(user.name):
-            del images[img]
+    user = users.pop(sid)
+    scheduler.cancel(sid)
+
+    if grace_period > 0:
+        user.expiry = asyncio.get_running_loop().call_later(
+            grace_period, end_session, user
+        )
+    else:
+        end_session(user)
+
+
+def end_session(user: User) -> None:
+    """
+    Delete a disconnected user along with their images and subscriptions.
+    Images with a time-to-live are kept until it is over.
+    """
+
+    print("End Session: ", user)
+    user.expiry = None
+    for fn in list(user.shared):
+        key = f"{user.name}__{fn}"
+        if key in expiry:
+            continue
+        remove_image(key)
+        del user.shared[fn]
 
-    del users[sid]
+    subscriptions.remove_sid(user.sid)
+    if not user.shared:
+        del sessions[user.token]
 
 
 if __name__ == "__main__":
@@ -123,6 +550,16 @@ if __name__ == "__main__":
     debug_mode = args.get("debug", False)
     host = args.get("host", "0.0.0.0")
     port = args.get("port", 8080)
+    variants.max_bytes = int(args.get("variant_cache_mb", 256)) * 1_000_000
+    scheduler.concurrency = int(args.get("download_concurrency", 4))
+    grace_period = float(args.get("grace", 60))
+    federation = Federation(
+        peers=[url for url in args.get("peers", "").split(",") if url],
+        deadline=float(args.get("peer_deadline", 1)),
+    )
+    if "library" in args:
+        library = Library(args["library"])
+    library_rescan = float(args.get("library_rescan", 10))
 
     if not debug_mode:
         print = lambda *args, **kwargs: None  # Disable print statements
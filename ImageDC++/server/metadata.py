@@ -0,0 +1,314 @@
+import io
+import os
+import math
+import datetime
+from array import array
+from typing import Dict, List, Optional, Set, Tuple
+from PIL import Image
+
+EXIF_IFD = 0x8769
+EXIF_DATETIME_ORIGINAL = 0x9003
+EXIF_DATETIME = 0x0132
+EXIF_MAKE = 0x010F
+EXIF_MODEL = 0x0110
+
+# Filters that `search` accepts, mapped to the type of their value
+FILTERS = {
+    "min_width": int,
+    "max_width": int,
+    "min_height": int,
+    "max_height": int,
+    "min_size": int,
+    "max_size": int,
+    "format": str,
+    "taken_after": str,
+    "taken_before": str,
+    "camera": str,
+}
+
+
+def extract_metadata(data: bytes) -> Dict:
+    """
+    Extract lightweight metadata from an image without decoding its pixels.
+    Only the image header (and EXIF block, if present) is parsed.
+
+    Args:
+        data (bytes): The image bytes.
+
+    Returns:
+        Dict: The image's format, width, height, size, EXIF capture time (as a timestamp) and camera.
+    """
+
+    return _extract_metadata(io.BytesIO(data), len(data))
+
+
+def extract_file_metadata(path: str) -> Dict:
+    """
+    Same as `extract_metadata`, for an image file. Only the start of the file is read.
+    """
+
+    with open(path, "rb") as f:
+        return _extract_metadata(f, os.fstat(f.fileno()).st_size)
+
+
+def _extract_metadata(fp, size: int) -> Dict:
+    meta = {
+        "format": None,
+        "width": 0,
+        "height": 0,
+        "size": size,
+        "taken_at": None,
+        "camera": None,
+    }
+
+    try:
+        return _read_image_metadata(fp, dict(meta))
+    except Exception:
+        # Not an image, or one Pillow can't read: truncated, a decompression bomb, broken EXIF...
+        return meta
+
+
+def _read_image_metadata(fp, meta: Dict) -> Dict:
+    with Image.open(fp) as img:
+        meta["format"] = (img.format or "").lower() or None
+        meta["width"], meta["height"] = img.size
+
+        exif = Image.Exif()
+        if "exif" in img.info:
+            exif.load(img.info["exif"])
+        elif img.format != "PNG":
+            # PNG's getexif() decodes the whole image to look for a trailing eXIf chunk
+            exif = img.getexif()
+
+    taken_at = exif.get_ifd(EXIF_IFD).get(EXIF_DATETIME_ORIGINAL) or exif.get(
+        EXIF_DATETIME
+    )
+    if taken_at:
+        try:
+            meta["taken_at"] = datetime.datetime.strptime(
+                str(taken_at).strip("\x00 "), "%Y:%m:%d %H:%M:%S"
+            ).timestamp()
+        except ValueError:
+            pass
+
+    camera = " ".join(
+        str(exif[tag]).strip("\x00 ") for tag in (EXIF_MAKE, EXIF_MODEL) if tag in exif
+    )
+    meta["camera"] = camera or None
+
+    return meta
+
+
+def parse_filters(data: Dict) -> Dict:
+    """
+    Validate the filters of a search request.
+
+    Args:
+        data (Dict): The search request, which may contain any of the keys in `FILTERS`.
+
+    Returns:
+        Dict: The filters that were set, with dates converted to timestamps.
+
+    Raises:
+        ValueError: If any of the filters are invalid.
+    """
+
+    filters = {}
+    for name, kind in FILTERS.items():
+        value = data.get(name)
+        if value is None:
+            continue
+        if not isinstance(value, kind):
+            raise ValueError(f"{name} must be of type {kind.__name__}")
+        filters[name] = value
+
+    for name in ("taken_after", "taken_before"):
+        if name in filters:
+            try:
+                filters[name] = datetime.datetime.fromisoformat(
+                    filters[name]
+                ).timestamp()
+            except ValueError:
+                raise ValueError(f"{name} must be an ISO 8601 date (eg. 2023-10-24)")
+
+    if "format" in filters:
+        filters["format"] = filters["format"].lower().replace("jpg", "jpeg")
+
+    return filters
+
+
+class MetadataIndex:
+    """
+    A columnar index of image metadata.
+    Every column is a separate array, so a filter only ever touches the column it is about.
+
+    Attributes:
+        keys (List): The image key of every row.
+    """
+
+    def __init__(self) -> None:
+        self.keys: List[str] = []
+        self._rows: Dict[str, int] = {}
+
+        self._formats: List[Optional[str]] = []
+        self._widths = array("L")
+        self._heights = array("L")
+        self._sizes = array("Q")
+        self._taken_at = array("d")  # NaN when unknown
+        self._cameras: List[Optional[str]] = []
+
+    def __len__(self) -> int:
+        return len(self.keys)
+
+    def __contains__(self, key: str) -> bool:
+        return key in self._rows
+
+    def add(self, key: str, meta: Dict) -> None:
+        """
+        Add an image to the index, replacing its previous row if it was already indexed.
+        """
+
+        self.remove(key)
+
+        self._rows[key] = len(self.keys)
+        self.keys.append(key)
+        self._formats.append(meta["format"])
+        self._widths.append(meta["width"])
+        self._heights.append(meta["height"])
+        self._sizes.append(meta["size"])
+        self._taken_at.append(
+            meta["taken_at"] if meta["taken_at"] is not None else math.nan
+        )
+        self._cameras.append(meta["camera"])
+
+    def add_many(self, items: Dict[str, Dict]) -> None:
+        """
+        Add many images at once, extending each column in one go rather than row by row.
+
+        Args:
+            items (Dict): The metadata of every image, by key.
+        """
+
+        for key in items:
+            self.remove(key)
+
+        start = len(self.keys)
+        metas = list(items.values())
+        self._rows.update((key, start + i) for i, key in enumerate(items))
+        self.keys.extend(items)
+        self._formats.extend(meta["format"] for meta in metas)
+        self._widths.extend(meta["width"] for meta in metas)
+        self._heights.extend(meta["height"] for meta in metas)
+        self._sizes.extend(meta["size"] for meta in metas)
+        self._taken_at.extend(
+            meta["taken_at"] if meta["taken_at"] is not None else math.nan
+            for meta in metas
+        )
+        self._cameras.extend(meta["camera"] for meta in metas)
+
+    def remove(self, key: str) -> None:
+        """
+        Remove an image from the index in O(1) by moving the last row into its place.
+        """
+
+        row = self._rows.pop(key, None)
+        if row is None:
+            return
+
+        last = len(self.keys) - 1
+        columns = (
+            self.keys,
+            self._formats,
+            self._widths,
+            self._heights,
+            self._sizes,
+            self._taken_at,
+            self._cameras,
+        )
+        if row != last:
+            for column in columns:
+                column[row] = column[last]
+            self._rows[self.keys[row]] = row
+        for column in columns:
+            column.pop()
+
+    def get(self, key: str) -> Optional[Dict]:
+        """
+        Get the metadata of an indexed image.
+        """
+
+        row = self._rows.get(key)
+        if row is None:
+            return None
+
+        taken_at = self._taken_at[row]
+        return {
+            "format": self._formats[row],
+            "width": self._widths[row],
+            "height": self._heights[row],
+            "size": self._sizes[row],
+            "taken_at": None if math.isnan(taken_at) else taken_at,
+            "camera": self._cameras[row],
+        }
+
+    def _predicates(self, filters: Dict) -> List[Tuple]:
+        """
+        Get a (column, predicate) pair for every filter that is set.
+        """
+
+        predicates = []
+        if "format" in filters:
+            predicates.append((self._formats, lambda v: v == filters["format"]))
+        if "min_width" in filters:
+            predicates.append((self._widths, lambda v: v >= filters["min_width"]))
+        if "max_width" in filters:
+            predicates.append((self._widths, lambda v: v <= filters["max_width"]))
+        if "min_height" in filters:
+            predicates.append((self._heights, lambda v: v >= filters["min_height"]))
+        if "max_height" in filters:
+            predicates.append((self._heights, lambda v: v <= filters["max_height"]))
+        if "min_size" in filters:
+            predicates.append((self._sizes, lambda v: v >= filters["min_size"]))
+        if "max_size" in filters:
+            predicates.append((self._sizes, lambda v: v <= filters["max_size"]))
+        # Comparisons against NaN are always False, so undated images never match a date range
+        if "taken_after" in filters:
+            predicates.append((self._taken_at, lambda v: v >= filters["taken_after"]))
+        if "taken_before" in filters:
+            predicates.append((self._taken_at, lambda v: v <= filters["taken_before"]))
+        if "camera" in filters:
+            camera = filters["camera"].lower()
+            predicates.append(
+                (self._cameras, lambda v: v is not None and camera in v.lower())
+            )
+        return predicates
+
+    def filter(self, filters: Dict) -> Set[str]:
+        """
+        Get the keys of the images that match all the given filters.
+
+        Args:
+            filters (Dict): Filters as returned by `parse_filters`.
+
+        Returns:
+            Set: The keys of the matching images.
+        """
+
+        rows = range(len(self.keys))
+        for column, predicate in self._predicates(filters):
+            rows = [i for i in rows if predicate(column[i])]
+
+        return {self.keys[i] for i in rows}
+
+    def matches(self, key: str, filters: Dict) -> bool:
+        """
+        Check whether a single indexed image matches all the given filters.
+        """
+
+        row = self._rows.get(key)
+        if row is None:
+            return False
+
+        return all(
+            predicate(column[row]) for column, predicate in self._predicates(filters)
+        )
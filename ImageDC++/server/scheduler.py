@@ -0,0 +1,233 @@
+import asyncio
+import traceback
+from collections import deque
+from typing import Awaitable, Callable, Deque, Dict, List, Optional
+
+
+class DownloadCancelled(Exception):
+    """
+    Raised for queued downloads that were dropped before they started.
+    """
+
+
+class DownloadRequest:
+    """
+    Represents a download waiting for a free slot.
+
+    Args:
+        sid (str): The SID of the user that requested the download.
+        cost (int): The number of images in the download.
+        on_position (Callable): Called with the request's queue position whenever it changes.
+    """
+
+    def __init__(
+        self,
+        sid: str,
+        cost: int,
+        on_position: Optional[Callable[[int], Awaitable]] = None,
+    ) -> None:
+        self.sid = sid
+        self.cost = cost
+        self.on_position = on_position
+        self.position: Optional[int] = None
+        self.granted = asyncio.get_running_loop().create_future()
+
+    def __repr__(self) -> str:
+        return f"<DownloadRequest sid={self.sid} cost={self.cost}>"
+
+
+def _pick(
+    ring: Deque[str],
+    queues: Dict[str, Deque[DownloadRequest]],
+    deficits: Dict[str, int],
+    quantum: int,
+    in_turn: bool,
+):
+    """
+    Pick the next request using deficit round robin.
+
+    Every user with queued downloads gets `quantum` images worth of credit per round,
+    and a download is only started once its user has enough credit for it.
+    So a user asking for 1,000 images can't hold up users asking for a few.
+
+    The given structures are updated in place.
+
+    Returns:
+        Tuple: The picked request and whether the user at the front of the ring is still mid-turn.
+    """
+
+    while True:
+        sid = ring[0]
+        queue = queues[sid]
+        if not in_turn:
+            deficits[sid] += quantum
+            in_turn = True
+
+        if queue[0].cost <= deficits[sid]:
+            request = queue.popleft()
+            deficits[sid] -= request.cost
+            if not queue:
+                # Idle users don't keep their credit
+                ring.popleft()
+                del queues[sid]
+                del deficits[sid]
+                in_turn = False
+            return request, in_turn
+
+        ring.rotate(-1)
+        in_turn = False
+
+
+class DownloadScheduler:
+    """
+    Limits how many downloads are prepared at once and shares the slots fairly between users.
+
+    Args:
+        concurrency (int): The maximum number of downloads prepared at once.
+        quantum (int): The number of images each waiting user is credited per round.
+
+    Attributes:
+        running (int): The number of downloads currently being prepared.
+    """
+
+    def __init__(self, concurrency: int, quantum: int = 16) -> None:
+        self.concurrency = concurrency
+        self.quantum = quantum
+        self.running = 0
+
+        self._ring: Deque[str] = deque()  # Users with queued downloads, in turn order
+        self._queues: Dict[str, Deque[DownloadRequest]] = {}
+        self._deficits: Dict[str, int] = {}
+        self._in_turn = False
+        self._notifier: Optional[asyncio.Task] = None  # Sends the queue positions
+        self._positions_stale = False
+
+    def __len__(self) -> int:
+        return sum(len(queue) for queue in self._queues.values())
+
+    async def run(
+        self,
+        sid: str,
+        cost: int,
+        job: Callable[[], Awaitable],
+        on_position: Optional[Callable[[int], Awaitable]] = None,
+    ):
+        """
+        Run a download job once a slot is free and it is this user's turn.
+
+        Args:
+            sid (str): The SID of the user that requested the download.
+            cost (int): The number of images in the download.
+            job (Callable): The coroutine function that prepares the download.
+            on_position (Callable): Called with the request's queue position whenever it changes.
+
+        Returns:
+            The result of the job.
+
+        Raises:
+            DownloadCancelled: If the user's queued downloads were cancelled.
+        """
+
+        request = DownloadRequest(sid, max(cost, 1), on_position)
+
+        if sid not in self._queues:
+            self._queues[sid] = deque()
+            self._deficits[sid] = 0
+            self._ring.append(sid)
+        self._queues[sid].append(request)
+
+        self._dispatch()
+        try:
+            await request.granted
+        except asyncio.CancelledError:
+            if request.granted.done() and request.granted.exception() is None:
+                # Granted just as the caller was cancelled, give the slot back
+                self.running -= 1
+                self._dispatch()
+            else:
+                self._discard(request)
+            raise
+
+        try:
+            return await job()
+        finally:
+            self.running -= 1
+            self._dispatch()
+
+    def cancel(self, sid: str) -> None:
+        """
+        Drop a user's queued downloads, eg. when they disconnect.
+        """
+
+        queue = self._queues.get(sid)
+        if queue is None:
+            return
+
+        self._remove_user(sid)
+        for request in queue:
+            request.granted.set_exception(DownloadCancelled())
+
+    def _discard(self, request: DownloadRequest) -> None:
+        queue = self._queues.get(request.sid)
+        if queue is None or request not in queue:
+            return
+
+        queue.remove(request)
+        if not queue:
+            self._remove_user(request.sid)
+
+    def _remove_user(self, sid: str) -> None:
+        if self._ring[0] == sid:
+            self._in_turn = False
+        self._ring.remove(sid)
+        del self._queues[sid]
+        del self._deficits[sid]
+
+    def _order(self) -> List[DownloadRequest]:
+        """
+        Get the order the queued requests will be started in, without changing any state.
+        """
+
+        ring = deque(self._ring)
+        queues = {sid: deque(queue) for sid, queue in self._queues.items()}
+        deficits = dict(self._deficits)
+        in_turn = self._in_turn
+
+        order = []
+        while ring:
+            request, in_turn = _pick(ring, queues, deficits, self.quantum, in_turn)
+            order.append(request)
+        return order
+
+    def _dispatch(self) -> None:
+        while self.running < self.concurrency and self._ring:
+            request, self._in_turn = _pick(
+                self._ring, self._queues, self._deficits, self.quantum, self._in_turn
+            )
+            self.running += 1
+            request.granted.set_result(None)
+
+        # Positions are sent in the background, so no download waits on other users' clients
+        self._positions_stale = True
+        if self._notifier is None or self._notifier.done():
+            self._notifier = asyncio.create_task(self._notify_positions())
+
+    async def _notify_positions(self) -> None:
+        """
+        Send every queued request its position, until the positions stop changing.
+        """
+
+        while self._positions_stale:
+            self._positions_stale = False
+            updates = []
+            for position, request in enumerate(self._order(), start=1):
+                if request.on_position is not None and request.position != position:
+                    request.position = position
+                    updates.append(request.on_position(position))
+
+            # Sent concurrently, so one slow client doesn't hold up the others
+            for result in await asyncio.gather(*updates, return_exceptions=True):
+                if isinstance(result, Exception):
+                    traceback.print_exception(
+                        type(result), result, result.__traceback__
+                    )
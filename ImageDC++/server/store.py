@@ -0,0 +1,92 @@
+import os
+import hashlib
+from typing import Dict, Iterator, Optional
+
+
+class StoredImage:
+    """
+    Represents an image held by the server, either in memory or as a file on disk.
+
+    Args:
+        key (str): The image's key, in the form `{owner}__{filename}`.
+        data (bytes): The image bytes, if the image is held in memory.
+        path (str): The path of the image file, if the image is served from disk.
+
+    Attributes:
+        size (int): The size of the image in bytes.
+        etag (str): A strong ETag that changes whenever the image's contents change.
+    """
+
+    def __init__(
+        self, key: str, data: Optional[bytes] = None, path: Optional[str] = None
+    ) -> None:
+        self.key = key
+        self.data = data
+        self.path = path
+
+        if path is not None:
+            st = os.stat(path)
+            self.size = st.st_size
+            # Same format as aiohttp's FileResponse, so both agree on the ETag
+            self.etag = f'"{st.st_mtime_ns:x}-{st.st_size:x}"'
+        else:
+            self.size = len(data)
+            self.etag = f'"{hashlib.sha256(data).hexdigest()[:32]}"'
+
+    def __repr__(self) -> str:
+        return f"<StoredImage key={self.key} size={self.size}>"
+
+    def read(self) -> bytes:
+        if self.data is not None:
+            return self.data
+        with open(self.path, "rb") as f:
+            return f.read()
+
+
+class ImageStore:
+    """
+    Holds every image shared with the server, keyed by `{owner}__{filename}`.
+    Uploaded images are kept in memory, while images that already live on disk
+    are only referenced by path and read or streamed from disk when needed.
+    """
+
+    def __init__(self) -> None:
+        self._images: Dict[str, StoredImage] = {}
+
+    def __len__(self) -> int:
+        return len(self._images)
+
+    def __contains__(self, key: str) -> bool:
+        return key in self._images
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._images)
+
+    def keys(self):
+        return self._images.keys()
+
+    def get(self, key: str) -> Optional[StoredImage]:
+        return self._images.get(key)
+
+    def put_bytes(self, key: str, data: bytes) -> StoredImage:
+        image = StoredImage(key, data=data)
+        self._images[key] = image
+        return image
+
+    def put_file(self, key: str, path: str) -> StoredImage:
+        image = StoredImage(key, path=path)
+        self._images[key] = image
+        return image
+
+    def read(self, key: str) -> bytes:
+        """
+        Get an image's bytes.
+
+        Raises:
+            KeyError: If there is no image with this key.
+        """
+
+        return self._images[key].read()
+
+    def remove(self, key: str) -> Optional[StoredImage]:
+        return self._images.pop(key, None)
@@ -0,0 +1,136 @@
+import itertools
+from fuzzywuzzy import fuzz
+from fuzzywuzzy.utils import full_process
+from typing import Dict, List, Set, Tuple
+
+
+def trigrams(text: str) -> Set[str]:
+    """
+    Get the trigrams of every word in a text, with each word padded so short words still have trigrams.
+    """
+
+    result = set()
+    # Keys are "owner__filename", split them so the filename's first word isn't joined to the owner
+    for word in full_process(text.replace("__", " ")).split():
+        padded = f"  {word} "
+        result.update(padded[i : i + 3] for i in range(len(padded) - 2))
+    return result
+
+
+class Subscription:
+    """
+    Represents a user's subscription to new images matching a search.
+
+    Args:
+        id (int): The subscription's unique identifier.
+        sid (str): The SID of the subscribed user.
+        query (str): The search query, may be empty if only filters are used.
+        filters (Dict): Metadata filters as returned by `parse_filters`.
+    """
+
+    def __init__(self, id: int, sid: str, query: str, filters: Dict) -> None:
+        self.id = id
+        self.sid = sid
+        self.query = query
+        self.filters = filters
+        self.trigrams = trigrams(query)
+
+    def __repr__(self) -> str:
+        return f"<Subscription id={self.id} sid={self.sid} query={self.query!r}>"
+
+
+class SubscriptionIndex:
+    """
+    Matches newly uploaded images against the active subscriptions.
+
+    Subscriptions are indexed by the trigrams of their query, so an upload is only
+    fuzzy-scored against the subscriptions that share at least one trigram with it.
+    Subscriptions without a query (filters only) are checked against every upload.
+    """
+
+    def __init__(self) -> None:
+        self._ids = itertools.count(1)
+        self._subscriptions: Dict[int, Subscription] = {}
+        self._by_trigram: Dict[str, Set[int]] = {}
+        self._by_sid: Dict[str, Set[int]] = {}
+        self._unindexed: Set[int] = set()
+
+    def __len__(self) -> int:
+        return len(self._subscriptions)
+
+    def add(self, sid: str, query: str, filters: Dict) -> Subscription:
+        sub = Subscription(next(self._ids), sid, query, filters)
+        self._subscriptions[sub.id] = sub
+        self._by_sid.setdefault(sid, set()).add(sub.id)
+
+        if sub.trigrams:
+            for gram in sub.trigrams:
+                self._by_trigram.setdefault(gram, set()).add(sub.id)
+        else:
+            self._unindexed.add(sub.id)
+
+        return sub
+
+    def remove(self, sub_id: int) -> None:
+        sub = self._subscriptions.pop(sub_id, None)
+        if sub is None:
+            return
+
+        self._by_sid[sub.sid].discard(sub_id)
+        if not self._by_sid[sub.sid]:
+            del self._by_sid[sub.sid]
+
+        self._unindexed.discard(sub_id)
+        for gram in sub.trigrams:
+            ids = self._by_trigram[gram]
+            ids.discard(sub_id)
+            if not ids:
+                del self._by_trigram[gram]
+
+    def remove_sid(self, sid: str) -> None:
+        """
+        Remove every subscription of a user, eg. when they disconnect.
+        """
+
+        for sub_id in list(self._by_sid.get(sid, ())):
+            self.remove(sub_id)
+
+    def move_sid(self, old_sid: str, new_sid: str) -> None:
+        """
+        Move a user's subscriptions to their new SID, eg. when they resume their session.
+        """
+
+        ids = self._by_sid.pop(old_sid, set())
+        for sub_id in ids:
+            self._subscriptions[sub_id].sid = new_sid
+        if ids:
+            self._by_sid[new_sid] = ids
+
+    def owned_by(self, sid: str, sub_id: int) -> bool:
+        sub = self._subscriptions.get(sub_id)
+        return sub is not None and sub.sid == sid
+
+    def match(self, key: str, score_cutoff: int = 40) -> List[Tuple[Subscription, int]]:
+        """
+        Find the subscriptions whose query matches an image key.
+        Filters are not checked here, as they need the image's metadata.
+
+        Args:
+            key (str): The key of the new image.
+            score_cutoff (int): The minimum fuzzy score for a match, same as `search`.
+
+        Returns:
+            List: The matching subscriptions with their scores.
+        """
+
+        candidates = set(self._unindexed)
+        for gram in trigrams(key):
+            candidates.update(self._by_trigram.get(gram, ()))
+
+        matches = []
+        for sub_id in candidates:
+            sub = self._subscriptions[sub_id]
+            score = fuzz.WRatio(sub.query, key) if sub.query else 100
+            if score >= score_cutoff:
+                matches.append((sub, score))
+        return matches
@@ -1,7 +1,9 @@
 import io
 import os
+import secrets
 import zipfile
-from typing import List, Dict
+import asyncio
+from typing import List, Dict, Optional
 
 
 class User:
@@ -13,15 +15,19 @@ class User:
         name (str): The user's name.
 
     Attributes:
-        sid (str): The user's unique identifier.
+        sid (str): The user's unique identifier (of their latest connection).
         name (str): The user's name.
-        shared (List): A list of the names of the files this user shared.
+        shared (Dict): The names of the files this user shared, as an ordered set (values are unused).
+        token (str): The secret token the user can resume their session with after a disconnect.
+        expiry (asyncio.TimerHandle): Ends the user's session, set while they are disconnected.
     """
 
     def __init__(self, sid: str, name: str) -> None:
         self.sid = sid
         self.name = name
-        self.shared: List[str] = []  # A list of the names of the files this user shared
+        self.shared: Dict[str, None] = {}  # The names of the files this user shared
+        self.token = secrets.token_urlsafe(16)
+        self.expiry: Optional[asyncio.TimerHandle] = None
 
     def __repr__(self) -> str:
         return f"<User name={self.name} sid={self.sid}>"
@@ -52,6 +58,7 @@ def ensure_non_clashing_name(name: str, names: List[str]):
 def clean_name(name):
     """
     Clean a name by replacing consecutive underscores with a single underscore.
+    `@` is removed too, as it marks images shared on peer servers.
 
     Args:
         name (str): The input name to clean.
@@ -64,7 +71,7 @@ def clean_name(name):
         print(cleaned_name)  # Output: "example_name"
     """
 
-    parts = name.split("_")
+    parts = name.replace("@", "").split("_")
     cleaned_parts = [parts[0]]  # Initialize with the first part
     for part in parts[1:]:
         if part:  # Ignore empty parts
@@ -0,0 +1,201 @@
+import io
+import asyncio
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, Optional, Set, Tuple
+from PIL import Image
+
+# Output formats a download can be transcoded to, mapped to (Pillow format, file extension)
+FORMATS = {
+    "jpeg": ("JPEG", "jpg"),
+    "png": ("PNG", "png"),
+    "webp": ("WEBP", "webp"),
+}
+
+DEFAULT_QUALITY = 85
+
+VariantOptions = Tuple[Optional[int], Optional[str], Optional[int]]
+
+
+def parse_variant_options(data: Dict) -> VariantOptions:
+    """
+    Validate the variant options of a download request.
+
+    Args:
+        data (Dict): The download request, optionally containing `max_dimension`, `format` and `quality`.
+
+    Returns:
+        Tuple: The (max_dimension, format, quality) options, each of which may be None.
+
+    Raises:
+        ValueError: If any of the options are invalid.
+    """
+
+    max_dimension = data.get("max_dimension")
+    fmt = data.get("format")
+    quality = data.get("quality")
+
+    if max_dimension is not None:
+        # bool is a subclass of int, but `true` isn't a size
+        if (
+            isinstance(max_dimension, bool)
+            or not isinstance(max_dimension, int)
+            or max_dimension <= 0
+        ):
+            raise ValueError("max_dimension must be a positive integer")
+
+    if fmt is not None:
+        if not isinstance(fmt, str):
+            raise ValueError(f"format must be one of {', '.join(FORMATS)}")
+        fmt = fmt.lower()
+        if fmt == "jpg":
+            fmt = "jpeg"
+        if fmt not in FORMATS:
+            raise ValueError(f"format must be one of {', '.join(FORMATS)}")
+
+    if quality is not None:
+        if (
+            isinstance(quality, bool)
+            or not isinstance(quality, int)
+            or not 1 <= quality <= 95
+        ):
+            raise ValueError("quality must be an integer between 1 and 95")
+
+    return max_dimension, fmt, quality
+
+
+def variant_filename(filename: str, options: VariantOptions) -> str:
+    """
+    Get the filename of a variant, swapping the extension if the image is transcoded.
+    """
+
+    fmt = options[1]
+    if fmt is None:
+        return filename
+    stem = filename.rsplit(".", 1)[0]
+    return f"{stem}.{FORMATS[fmt][1]}"
+
+
+def make_variant(data: bytes, options: VariantOptions) -> bytes:
+    """
+    Downscale and/or transcode an image.
+
+    Args:
+        data (bytes): The original image bytes.
+        options (Tuple): The (max_dimension, format, quality) options.
+
+    Returns:
+        bytes: The encoded variant.
+    """
+
+    max_dimension, fmt, quality = options
+
+    with Image.open(io.BytesIO(data)) as img:
+        if max_dimension is not None:
+            # Let JPEGs decode at a reduced scale instead of decoding the full image
+            img.draft("RGB", (max_dimension, max_dimension))
+            img.thumbnail((max_dimension, max_dimension))
+
+        pil_format = FORMATS[fmt][0] if fmt is not None else img.format
+        if pil_format == "JPEG" and img.mode not in ("RGB", "L"):
+            img = img.convert("RGB")
+
+        out = io.BytesIO()
+        img.save(out, pil_format, quality=quality or DEFAULT_QUALITY)
+
+    return out.getvalue()
+
+
+class VariantStore:
+    """
+    Produces downscaled/transcoded variants of images in a pool of worker processes,
+    and keeps them in a size-bounded LRU cache keyed by (image, options).
+
+    Args:
+        max_bytes (int): The maximum total size of the cached variants.
+        workers (int): The number of worker processes, defaults to the number of CPUs.
+
+    Attributes:
+        max_bytes (int): The maximum total size of the cached variants.
+        size (int): The current total size of the cached variants.
+    """
+
+    def __init__(self, max_bytes: int, workers: Optional[int] = None) -> None:
+        self.max_bytes = max_bytes
+        self.size = 0
+        self._workers = workers
+        self._pool: Optional[ProcessPoolExecutor] = None
+        self._cache: OrderedDict[Tuple[str, VariantOptions], bytes] = OrderedDict()
+        self._by_image: Dict[str, Set[VariantOptions]] = {}
+        self._pending: Dict[Tuple[str, VariantOptions], asyncio.Future] = {}
+
+    async def get(self, key: str, data: bytes, options: VariantOptions) -> bytes:
+        """
+        Get a variant of an image, producing it if it isn't cached.
+        Concurrent requests for the same variant share a single worker job.
+
+        Args:
+            key (str): The key of the image in the server's image store.
+            data (bytes): The original image bytes.
+            options (Tuple): The (max_dimension, format, quality) options.
+
+        Returns:
+            bytes: The encoded variant.
+        """
+
+        cache_key = (key, options)
+        if cache_key in self._cache:
+            self._cache.move_to_end(cache_key)
+            return self._cache[cache_key]
+
+        if cache_key in self._pending:
+            return await asyncio.shield(self._pending[cache_key])
+
+        if self._pool is None:
+            self._pool = ProcessPoolExecutor(max_workers=self._workers)
+
+        future = asyncio.get_running_loop().run_in_executor(
+            self._pool, make_variant, data, options
+        )
+        self._pending[cache_key] = future
+        try:
+            variant = await future
+        finally:
+            # The image may have been replaced while the variant was being made
+            fresh = self._pending.get(cache_key) is future
+            if fresh:
+                del self._pending[cache_key]
+
+        if fresh:
+            self._put(cache_key, variant)
+        return variant
+
+    def _put(self, cache_key: Tuple[str, VariantOptions], variant: bytes) -> None:
+        if len(variant) > self.max_bytes:
+            return
+
+        self._cache[cache_key] = variant
+        self._by_image.setdefault(cache_key[0], set()).add(cache_key[1])
+        self.size += len(variant)
+
+        while self.size > self.max_bytes:
+            (key, options), evicted = self._cache.popitem(last=False)
+            self.size -= len(evicted)
+            self._forget(key, options)
+
+    def _forget(self, key: str, options: VariantOptions) -> None:
+        variants = self._by_image[key]
+        variants.discard(options)
+        if not variants:
+            del self._by_image[key]
+
+    def discard(self, key: str) -> None:
+        """
+        Drop every cached variant of an image, eg. when it is replaced or deleted.
+        """
+
+        for options in self._by_image.pop(key, ()):
+            self.size -= len(self._cache.pop((key, options)))
+
+        for cache_key in [k for k in self._pending if k[0] == key]:
+            del self._pending[cache_key]